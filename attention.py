@@ -11,6 +11,7 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils import clip_grad_norm_
 from dataset import DataSet
+from feature import TIME_FEATURES, FeatureCache, time_features, training_scaler
 import os
 
 device = torch.device("cuda"if torch.cuda.is_available() else "cpu")
@@ -63,6 +64,18 @@ class Encoder(nn.Module):
         return outputs, hidden
 
 
+def sequence_mask(len_seq, max_len):
+    '''
+    Args:
+        len_seq: lengths of sequences in a batch, a list or a LongTensor.
+        max_len: the padded length.
+    Return:
+        A bool tensor [B*max_len] on device, True inside the length of a sequence.
+    '''
+    len_seq = torch.as_tensor(len_seq, device=device)
+    return torch.arange(max_len, device=device).unsqueeze(0) < len_seq.unsqueeze(1)
+
+
 class Attention(nn.Module):
     def __init__(self, hidden_size):
         super(Attention, self).__init__()
@@ -72,29 +85,31 @@ class Attention(nn.Module):
         stdv = 1. / math.sqrt(self.v.size(0))
         self.v.data.uniform_(-stdv, stdv)
 
-    def forward(self, hidden, encoder_outputs, len_seq):
-        timestep = encoder_outputs.size(0)
-        h = hidden.repeat(timestep, 1,  1).transpose(0, 1)
-        encoder_outputs = encoder_outputs.transpose(0, 1)  # [B*T*H]
-        attn_energies = self.score(h, encoder_outputs)
-        new_atten = []
-        for i,l in enumerate(len_seq):
-            if l == timestep:
-                temp_atten = F.softmax(attn_energies[i:i+1,],dim=1)
-            else:
-                # temp_atten = torch.cat([F.softmax(attn_energies[i:i+1,:l],dim=1),Variable(torch.zeros(1,timestep-l)).cuda()],1)
-                temp_atten = torch.cat([F.softmax(attn_energies[i:i + 1, :l], dim=1), Variable(torch.zeros(1, timestep - l)).to(device)], 1)
-            new_atten.append(temp_atten)
-        new_atten = torch.cat(new_atten,0)
-        return new_atten.unsqueeze(1)
-
-    def score(self, hidden, encoder_outputs):
-        # [B*T*2H]->[B*T*H]
-        energy = F.relu(self.attn(torch.cat([hidden, encoder_outputs], 2)))
-        energy = energy.transpose(1, 2)  # [B*H*T]
-        v = self.v.repeat(encoder_outputs.size(0), 1).unsqueeze(1)  # [B*1*H]
-        energy = torch.bmm(v, energy)  # [B*1*T]
-        return energy.squeeze(1)  # [B*T]
+    def forward(self, hidden, encoder_outputs, mask, encoder_proj=None):
+        '''
+        mask: [B*T] bool, False beyond the length of a sequence, see sequence_mask
+        '''
+        if encoder_proj is None:
+            encoder_proj = self.project(encoder_outputs)
+        attn_energies = self.score(hidden, encoder_proj)
+        # weights beyond the length are exactly 0 after the softmax
+        attn_energies = attn_energies.masked_fill(~mask, float('-inf'))
+        return F.softmax(attn_energies,dim=1).unsqueeze(1)
+
+    def project(self, encoder_outputs):
+        '''
+        The encoder half of the projection of [hidden;encoder_outputs] with its bias, which is the
+        same at every decoding step, so it is computed once per sequence.
+        [T*B*H]->[B*T*H]
+        '''
+        weight = self.attn.weight[:, self.hidden_size:]
+        return F.linear(encoder_outputs.transpose(0, 1), weight, self.attn.bias)
+
+    def score(self, hidden, encoder_proj):
+        # W[h;e]+b = W_h*h + (W_e*e+b), only the hidden half is projected at every step
+        hidden_proj = F.linear(hidden, self.attn.weight[:, :self.hidden_size])  # [B*H]
+        energy = F.relu(encoder_proj + hidden_proj.unsqueeze(1))  # [B*T*H]
+        return energy.matmul(self.v)  # [B*T]
 
 
 class Decoder(nn.Module):
@@ -112,12 +127,12 @@ class Decoder(nn.Module):
             nn.Linear(hidden_size * 2, output_size)
             )
 
-    def forward(self, input, last_hidden, encoder_outputs, len_seq):
+    def forward(self, input, last_hidden, encoder_outputs, mask, encoder_proj=None):
         # Get the embedding of the current input word (last output word)
         # embedded = self.embed(input).unsqueeze(0)  # (1,B,N)
         embedded = input.unsqueeze(0)
         # Calculate attention weights and apply to encoder outputs
-        attn_weights = self.attention(last_hidden[-1], encoder_outputs, len_seq)
+        attn_weights = self.attention(last_hidden[-1], encoder_outputs, mask, encoder_proj)
         context = attn_weights.bmm(encoder_outputs.transpose(0, 1))  # (B,1,N)
         context = context.transpose(0, 1)  # (1,B,N)
         # Combine embedded input word and attended context, run through RNN
@@ -147,6 +162,8 @@ class Seq2Seq(nn.Module):
         encoder_output, hidden = self.encoder(src, len_seq)
         hidden = hidden[:self.decoder.n_layers]
         output = Variable(trg.data[0,])  # sos
+        mask = sequence_mask(len_seq, encoder_output.size(0))  # built once for all steps
+        encoder_proj = self.decoder.attention.project(encoder_output)
 
         if is_analyse:
             analyse_data = OrderedDict()
@@ -154,7 +171,7 @@ class Seq2Seq(nn.Module):
             analyse_data['atten'] = []
         for t in range(1, max_len):
             output, hidden, attn_weights = self.decoder(
-                    output, hidden, encoder_output, len_seq)
+                    output, hidden, encoder_output, mask, encoder_proj)
             outputs[t] = output
             if teacher_forcing_ratio == None:
                 teacher_forcing_ratio = self.teacher_forcing_ratio
@@ -171,12 +188,16 @@ class Seq2Seq(nn.Module):
 
 
 class RUL():
-    def __init__(self):
+    def __init__(self,cache=False):
         self.hidden_size = 200
         self.epochs = 500
         self.lr = 1e-3
         self.gama = 0.7
-        self.dataset = DataSet.load_dataset(name='phm_data')
+        self.dataset = DataSet.load_dataset(name='phm_data',cache=cache)
+        self.time_features = list(TIME_FEATURES)
+        self.feature_cache = FeatureCache()
+        self.scaler = None # or 'min-max', 'decade', 'z-score' fitted on the training features
+        self.scaler_dir = './model/'
         self.train_bearings = ['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']
         self.test_bearings = ['Bearing1_3','Bearing1_4','Bearing1_5','Bearing1_6','Bearing1_7',
                                 'Bearing2_3','Bearing2_4','Bearing2_5','Bearing2_6','Bearing2_7',
@@ -309,11 +330,10 @@ class RUL():
         sio.savemat('analyse_data.mat',analyse_data)
 
     def _custom_loss(self, pred, tru, seq_len):
-        total_loss = 0
-        for i,l in enumerate(seq_len):
-            loss = torch.mean((tru[:l,i,:] - pred[:l,i,:])**2)
-            total_loss += loss
-        return total_loss/len(seq_len)
+        # mean over sequences of the mse inside the length of every sequence
+        mask = sequence_mask(seq_len, tru.size(0)).t().unsqueeze(2).type_as(pred)  # [T*B*1]
+        seq_loss = ((tru - pred)**2 * mask).sum(dim=(0,2)) / (mask.sum(dim=(0,2)) * tru.size(2))
+        return seq_loss.mean()
 
         
     def _evaluate(self, model, val_iter):
@@ -427,51 +447,52 @@ class RUL():
     
     def _preprocess(self, select, is_analyse=False):
         if select == 'train':
-            temp_data = self.dataset.get_value('data',condition={'bearing_name':self.train_bearings})
-            temp_label = self.dataset.get_value('RUL',condition={'bearing_name':self.train_bearings})
+            bearings = self.train_bearings
         elif select == 'test':
-            temp_data = self.dataset.get_value('data',condition={'bearing_name':self.test_bearings})
-            temp_label = self.dataset.get_value('RUL',condition={'bearing_name':self.test_bearings})
+            bearings = self.test_bearings
         else:
             raise ValueError('wrong selection!')
 
-        for i,x in enumerate(temp_label):
-            temp_label[i] = np.arange(temp_data[i].shape[0]) + x
-            temp_label[i] = temp_label[i][:,np.newaxis,np.newaxis]
-            temp_label[i] = temp_label[i] / np.max(temp_label[i])
-            temp_label[i] = temp_label[i][::8] # when chang 10
-        for i,x in enumerate(temp_data):
-            temp_data[i] = x[::-1,].transpose(0,2,1)
-        time_feature = [self._get_time_fea(x) for x in temp_data]
+        # features are cached without normalization, both outputs of analyse come from one extraction
+        key = self.feature_cache.key(self.dataset.fingerprint(),bearings,'time',8,self.time_features)
+        cached = self.feature_cache.get(key)
+        if cached is None:
+            temp_data = self.dataset.get_value('data',condition={'bearing_name':bearings})
+            temp_label = self.dataset.get_value('RUL',condition={'bearing_name':bearings})
+            cached = OrderedDict()
+            for i,x in enumerate(temp_label):
+                temp_label[i] = np.arange(temp_data[i].shape[0]) + x
+                temp_label[i] = temp_label[i][:,np.newaxis,np.newaxis]
+                temp_label[i] = temp_label[i] / np.max(temp_label[i])
+                cached['label_%d' % i] = temp_label[i][::8] # when chang 10
+            for i,x in enumerate(temp_data):
+                cached['fea_%d' % i] = self._get_time_fea(x[::-1,].transpose(0,2,1), is_norm=False)
+            cached = self.feature_cache.put(key,cached)
+
+        n = len([x for x in cached.keys() if x.startswith('label_')])
+        temp_label = [cached['label_%d' % i] for i in range(n)]
+        time_feature_no_norm = [cached['fea_%d' % i] for i in range(n)]
+        self.feature_size = time_feature_no_norm[0].shape[2]
+        if self.scaler is None:
+            time_feature = [self._normalize(x,dim=2) for x in time_feature_no_norm]
+        else:
+            # fitted on the training features and saved with the models, the others load it. The
+            # scaler is keyed by the snapshot counts of the training bearings instead of the dataset
+            # fingerprint, so appending snapshots to other bearings does not refit it
+            training = [self.dataset.get_value(x,condition={'bearing_name':self.train_bearings})
+                        for x in ['bearing_name','quantity']]
+            scaler = training_scaler(self.scaler,self.scaler_dir,'attention',
+                                     (training,'time',self.time_features),
+                                     fea=time_feature_no_norm if select == 'train' else None,
+                                     fit=lambda: self._preprocess('train'))
+            time_feature = [scaler.transform(x) for x in time_feature_no_norm]
         if is_analyse:
-            time_feature_no_norm = [self._get_time_fea(x, is_norm=False) for x in temp_data]
             return time_feature, time_feature_no_norm, temp_label
         else:
             return time_feature, temp_label
 
     def _get_time_fea(self, data, is_norm=True):
-        fea_dict = OrderedDict()
-        fea_dict['mean'] = np.mean(data,axis=2,keepdims=True)
-        fea_dict['rms'] = np.sqrt(np.mean(data**2,axis=2,keepdims=True))
-        fea_dict['kur'] = np.sum((data-fea_dict['mean'].repeat(data.shape[2],axis=2))**4,axis=2) \
-                / (np.var(data,axis=2)**2*data.shape[2])
-        fea_dict['kur'] = fea_dict['kur'][:,:,np.newaxis]
-        fea_dict['skew'] = np.sum((data-fea_dict['mean'].repeat(data.shape[2],axis=2))**3,axis=2) \
-                / (np.var(data,axis=2)**(3/2)*data.shape[2])
-        fea_dict['skew'] = fea_dict['skew'][:,:,np.newaxis]
-        fea_dict['p2p'] = np.max(data,axis=2,keepdims=True) - np.min(data,axis=2,keepdims=True)
-        fea_dict['var'] = np.var(data,axis=2,keepdims=True)
-        fea_dict['cre'] = np.max(abs(data),axis=2,keepdims=True) / fea_dict['rms']
-        fea_dict['imp'] = np.max(abs(data),axis=2,keepdims=True) \
-                / np.mean(abs(data),axis=2,keepdims=True)
-        fea_dict['mar'] = np.max(abs(data),axis=2,keepdims=True) \
-                / (np.mean((abs(data))**0.5,axis=2,keepdims=True))**2
-        fea_dict['sha'] = fea_dict['rms'] / np.mean(abs(data),axis=2,keepdims=True)
-        fea_dict['smr'] = (np.mean((abs(data))**0.5,axis=2,keepdims=True))**2
-        fea_dict['cle'] = fea_dict['p2p'] / fea_dict['smr']
-
-        fea = np.concatenate(tuple(x for x in fea_dict.values()),axis=2)
-        fea = fea.reshape(-1,fea.shape[1]*fea.shape[2])
+        fea = time_features(data,self.time_features)
         self.feature_size = fea.shape[1]
         if is_norm:
             fea = self._normalize(fea,dim=1)
@@ -9,8 +9,10 @@ import torch
 from torch import nn, optim
 from torch.autograd import Variable
 import torch.nn.functional as F
-from torch.nn.utils import clip_grad_norm_
 from dataset import DataSet
+from feature import TIME_FEATURES, FeatureCache, training_scaler
+from sequence import (feature_extractors, bearing_features, bearing_counts, scale_features, tensor_iter,
+                      fit_epoch, eval_batches, evaluate, window_index)
 
 device = torch.device("cuda"if torch.cuda.is_available() else "cpu")
 
@@ -22,10 +24,11 @@ device = torch.device("cuda"if torch.cuda.is_available() else "cpu")
 
 class Encoder(nn.Module):
     def __init__(self, input_size, hidden_size, cnn_k_s, strides,
-                 n_layers=1, dropout=0.5):
+                 n_layers=1, dropout=0.5, bidirectional=True):
         super(Encoder, self).__init__()
         self.input_size = input_size
         self.hidden_size = hidden_size
+        self.bidirectional = bidirectional
         self.cnn_kernel_size = cnn_k_s
         self.cnn_strides = strides
         self.cnn = nn.Sequential(
@@ -34,19 +37,30 @@ class Encoder(nn.Module):
             nn.PReLU()
             )
         self.gru = nn.GRU(64, hidden_size, n_layers,
-                          dropout=dropout, bidirectional=True)
+                          dropout=dropout, bidirectional=bidirectional)
 
-    def forward(self, x, hidden=None):
+    def forward(self, x, hidden=None, len_seq=None):
         x = x.permute(1,2,0)  # [B*N*T]
         # padding = self.cnn_kernel_size - x.size(2) % self.cnn_strides
         # x = F.pad(x, (0,padding))
         x = self.cnn(x)
         x = x.permute(2,0,1).contiguous()  # [T*B*N]
+        timestep = x.size(0)
+        if len_seq is not None:
+            # padded steps of shorter sequences are skipped by both directions of the GRU
+            x = nn.utils.rnn.pack_padded_sequence(x, self.output_len(len_seq), enforce_sorted=False)
         outputs, hidden = self.gru(x, hidden)
-        outputs = (outputs[:, :, :self.hidden_size] +
-                   outputs[:, :, self.hidden_size:])
+        if len_seq is not None:
+            outputs = nn.utils.rnn.pad_packed_sequence(outputs, total_length=timestep)[0]
+        if getattr(self, 'bidirectional', True):
+            outputs = (outputs[:, :, :self.hidden_size] +
+                       outputs[:, :, self.hidden_size:])
         return outputs, hidden
 
+    def output_len(self, len_seq):
+        # lengths after the convolution without padding, floor((L-k)/s)+1
+        return (len_seq - self.cnn_kernel_size) // self.cnn_strides + 1
+
 
 class Attention(nn.Module):
     def __init__(self, hidden_size):
@@ -60,20 +74,28 @@ class Attention(nn.Module):
         stdv = 1. / math.sqrt(self.v.size(0))
         self.v.data.uniform_(-stdv, stdv)
 
-    def forward(self, hidden, encoder_outputs):
-        timestep = encoder_outputs.size(0)
-        h = hidden.repeat(timestep, 1,  1).transpose(0, 1)
-        encoder_outputs = encoder_outputs.transpose(0, 1)  # [B*T*H]
-        attn_energies = self.score(h, encoder_outputs)
+    def forward(self, hidden, encoder_outputs, mask=None, encoder_proj=None):
+        if encoder_proj is None:
+            encoder_proj = self.project(encoder_outputs)
+        attn_energies = self.score(hidden, encoder_proj)
+        if mask is not None:
+            attn_energies = attn_energies.masked_fill(~mask, float('-inf'))
         return F.softmax(attn_energies,dim=1).unsqueeze(1)
 
-    def score(self, hidden, encoder_outputs):
-        # [B*T*2H]->[B*T*H]
-        energy = self.attn(torch.cat([hidden, encoder_outputs], 2))
-        energy = energy.transpose(1, 2)  # [B*H*T]
-        v = self.v.repeat(encoder_outputs.size(0), 1).unsqueeze(1)  # [B*1*H]
-        energy = torch.bmm(v, energy)  # [B*1*T]
-        return energy.squeeze(1)  # [B*T]
+    def project(self, encoder_outputs):
+        '''
+        The encoder half of the projection of [hidden;encoder_outputs] with its bias, which is the
+        same at every decoding step, so it is computed once per sequence.
+        [T*B*H]->[B*T*H]
+        '''
+        weight = self.attn[0].weight[:, self.hidden_size:]
+        return F.linear(encoder_outputs.transpose(0, 1), weight, self.attn[0].bias)
+
+    def score(self, hidden, encoder_proj):
+        # W[h;e]+b = W_h*h + (W_e*e+b), only the hidden half is projected at every step
+        hidden_proj = F.linear(hidden, self.attn[0].weight[:, :self.hidden_size])  # [B*H]
+        energy = self.attn[1](encoder_proj + hidden_proj.unsqueeze(1))  # [B*T*H]
+        return energy.matmul(self.v)  # [B*T]
 
 
 class Decoder(nn.Module):
@@ -89,12 +111,12 @@ class Decoder(nn.Module):
                           n_layers, dropout=dropout)
         self.out = nn.Linear(hidden_size * 2, output_size)
 
-    def forward(self, input, last_hidden, encoder_outputs):
+    def forward(self, input, last_hidden, encoder_outputs, mask=None, encoder_proj=None):
         # Get the embedding of the current input word (last output word)
         # embedded = self.embed(input).unsqueeze(0)  # (1,B,N)
         embedded = input.unsqueeze(0)
         # Calculate attention weights and apply to encoder outputs
-        attn_weights = self.attention(last_hidden[-1], encoder_outputs)
+        attn_weights = self.attention(last_hidden[-1], encoder_outputs, mask, encoder_proj)
         context = attn_weights.bmm(encoder_outputs.transpose(0, 1))  # (B,1,N)
         context = context.transpose(0, 1)  # (1,B,N)
         # Combine embedded input word and attended context, run through RNN
@@ -108,20 +130,49 @@ class Decoder(nn.Module):
 
 
 class Seq2Seq(nn.Module):
-    def __init__(self, encoder, decoder, teacher_forcing_ratio=0.5):
+    def __init__(self, encoder, decoder, teacher_forcing_ratio=0.5, attention_window=None, causal=False):
+        '''
+        attention_window: None to attend all encoder states, or w to attend the 2w+1 states around
+            the current step, shifted inside the sequence, so the cost of a step does not grow
+            with the length of the sequence.
+        causal: if True, the step t attends the states up to t only, the w+1 states ending at t
+            with attention_window, and the decoder starts from the first encoder state. With a
+            unidirectional encoder, the outputs then do not depend on later snapshots, which is
+            needed by StreamingSeq2Seq.
+        '''
         super(Seq2Seq, self).__init__()
         self.encoder = encoder
         self.decoder = decoder
         self.teacher_forcing_ratio = teacher_forcing_ratio
+        self.attention_window = attention_window
+        self.causal = causal
 
-    def forward(self, src, trg, teacher_forcing_ratio=None, is_analyse=False):
+    def forward(self, src, trg, teacher_forcing_ratio=None, is_analyse=False, len_seq=None):
+        '''
+        src: [T*B*N], trg: [T'*B*1], sequences of a batch are padded at the end
+        len_seq: lengths of src in a batch as a LongTensor on cpu, None if not padded
+        '''
         batch_size = src.size(1)
         max_len = trg.size(0)
         vocab_size = self.decoder.output_size
         outputs = Variable(torch.zeros(max_len, batch_size, vocab_size)).to(device)
 
-        encoder_output, hidden = self.encoder(src)
-        hidden = hidden[:self.decoder.n_layers]
+        encoder_output, hidden = self.encoder(src, len_seq=len_seq)
+        causal = getattr(self, 'causal', False)
+        if causal:
+            hidden = encoder_output[:1].repeat(self.decoder.n_layers, 1, 1)
+        else:
+            hidden = hidden[:self.decoder.n_layers]
+        encoder_proj = self.decoder.attention.project(encoder_output)  # shared by all steps
+        window = getattr(self, 'attention_window', None) # models saved before it attend globally
+        if causal and window is None:
+            window = encoder_output.size(0)
+        mask = None
+        len_encoder = torch.full((batch_size,), encoder_output.size(0), dtype=torch.long, device=device)
+        if len_seq is not None:
+            len_encoder = self.encoder.output_len(len_seq).to(device)
+            mask = (torch.arange(encoder_output.size(0), device=device).unsqueeze(0) <
+                    len_encoder.unsqueeze(1))  # [B*T]
         if teacher_forcing_ratio == None:
             teacher_forcing_ratio = self.teacher_forcing_ratio
         is_teacher = random.random() < teacher_forcing_ratio
@@ -130,30 +181,121 @@ class Seq2Seq(nn.Module):
             analyse_data = OrderedDict()
             analyse_data['fea_after_encoder'] = encoder_output.data.cpu().numpy()
             analyse_data['atten'] = []
+            analyse_data['atten_start'] = []
         for t in range(1, max_len):
-            output, hidden, attn_weights = self.decoder(
-                    output, hidden, encoder_output)
+            start = np.zeros(batch_size, dtype=np.int64)
+            if window is None:
+                output, hidden, attn_weights = self.decoder(
+                        output, hidden, encoder_output, mask, encoder_proj)
+            else:
+                index, valid = window_index(t, len_encoder, window, encoder_output.size(0), causal)  # [B*W]
+                start = index[:, 0].cpu().numpy()
+                step_mask = None if mask is None else mask.gather(1, index)
+                if valid is not None:
+                    step_mask = valid if step_mask is None else step_mask & valid
+                step_proj = encoder_proj.gather(1, index.unsqueeze(2).expand(-1, -1, encoder_proj.size(2)))
+                step_output = encoder_output.gather(
+                        0, index.t().unsqueeze(2).expand(-1, -1, encoder_output.size(2)))  # [W*B*H]
+                output, hidden, attn_weights = self.decoder(
+                        output, hidden, step_output, step_mask, step_proj)
             outputs[t] = output
             is_teacher = random.random() < teacher_forcing_ratio
             output = Variable(trg.data[t,] if is_teacher else output).to(device)
             if is_analyse:
                 analyse_data['atten'].append(attn_weights.data.cpu().numpy())
+                analyse_data['atten_start'].append(start)
         if is_analyse:
+            # weights of a windowed attention start at the encoder state atten_start of every step
             analyse_data['atten'] = np.concatenate(analyse_data['atten'],axis=0)
+            analyse_data['atten_start'] = np.array(analyse_data['atten_start'])
             return outputs, analyse_data
         else:
             return outputs
 
+class StreamingSeq2Seq():
+    '''
+    Streaming inference of a causal Seq2Seq with attention_window and a unidirectional encoder.
+    The states of the encoder and the decoder are kept between calls and advanced by the new
+    snapshots only, so the cost of an update does not depend on how long the bearing has run.
+    The predictions are the same as the model on the whole history with teacher_forcing_ratio=0.
+    '''
+    def __init__(self, model):
+        if getattr(model.encoder, 'bidirectional', True) or not getattr(model, 'causal', False) \
+                or getattr(model, 'attention_window', None) is None:
+            raise ValueError('model should be causal with attention_window and a unidirectional encoder!')
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        self.t = 0
+        self.buffer = None # snapshots not covered by a convolution yet
+        self.encoder_hidden = None
+        self.decoder_hidden = None
+        self.encoder_outputs = None # the last attention_window+1 encoder states, [W*1*H]
+        self.encoder_proj = None # and their projections, [1*W*H]
+        self.output = None
+
+    def update(self, snapshots):
+        '''
+        Args:
+            snapshots: features of new snapshots in time order, torch.Tensor [T*1*N].
+        Return:
+            The predictions of the encoder states completed by the snapshots, [T'*1*1], T' may be 0.
+        '''
+        encoder, decoder = self.model.encoder, self.model.decoder
+        k, s = encoder.cnn_kernel_size, encoder.cnn_strides
+        width = self.model.attention_window + 1
+        x = snapshots if self.buffer is None else torch.cat([self.buffer, snapshots], 0)
+        n = (x.size(0) - k) // s + 1 if x.size(0) >= k else 0
+        self.buffer = x[n*s:]
+        if n == 0:
+            return torch.zeros(0, 1, decoder.output_size, device=device)
+        x = encoder.cnn(x[:(n-1)*s+k].permute(1,2,0)).permute(2,0,1).contiguous()  # [n*1*64]
+        states, self.encoder_hidden = encoder.gru(x, self.encoder_hidden)
+        proj = decoder.attention.project(states)
+        outputs = []
+        for i in range(n):
+            if self.t == 0:
+                self.encoder_outputs, self.encoder_proj = states[:1], proj[:, :1]
+                self.decoder_hidden = states[:1].repeat(decoder.n_layers, 1, 1)
+                self.output = torch.zeros(1, decoder.output_size, device=device)
+            else:
+                self.encoder_outputs = torch.cat([self.encoder_outputs, states[i:i+1]], 0)[-width:]
+                self.encoder_proj = torch.cat([self.encoder_proj, proj[:, i:i+1]], 1)[:, -width:]
+                self.output, self.decoder_hidden, _ = decoder(
+                        self.output, self.decoder_hidden, self.encoder_outputs, None, self.encoder_proj)
+            outputs.append(self.output)
+            self.t += 1
+        return torch.stack(outputs, 0)
+
 
 class RUL():
-    def __init__(self):
+    def __init__(self,cache=False):
         self.hidden_size = 200
         self.epochs = 75
         self.lr = 4e-3
         self.gama = 0.7
         self.strides = 5
         self.en_cnn_k_s = 8
-        self.dataset = DataSet.load_dataset(name='phm_data')
+        self.batch_size = 1 # bearings per optimizer step, padded and packed if more than one
+        self.bucket = False # batches of bearings with similar lengths, less padding
+        self.attention_window = None # or w, attending 2w+1 encoder states around every step
+        self.eval_batch_size = None # bearings per forward pass of evaluation, all of them if None
+        # chronological bearings, a unidirectional encoder and causal attention, needed by stream_test
+        self.causal = False
+        self.dataset = DataSet.load_dataset(name='phm_data',cache=cache)
+        self.time_features = list(TIME_FEATURES)
+        self.fs = 25600
+        self.band_edges = None
+        self.fault_frequencies = None # characteristic frequencies in Hz, needed by fea_type 'env'
+        self.envelope_harmonics = 3
+        self.envelope_bandwidth = 5.
+        self.wpt_level = 3
+        self.feature_cache = FeatureCache()
+        self.n_workers = None
+        self.feature_backend = 'numpy' # or 'torch', extracting features in float32 by torch
+        self.scaler = None # or 'min-max', 'decade', 'z-score' fitted on the training features
+        self.scaler_dir = './model/'
         self.train_bearings = ['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']
         self.test_bearings = ['Bearing1_3','Bearing1_4','Bearing1_5','Bearing1_6','Bearing1_7',
                                 'Bearing2_3','Bearing2_4','Bearing2_5','Bearing2_6','Bearing2_7',
@@ -162,14 +304,15 @@ class RUL():
     
     def train(self):
         train_data,train_label = self._preprocess('train')
-        train_iter = [[train_data[i],train_label[i]] for i in range(len(train_data))]
+        train_iter = tensor_iter(train_data,train_label,device)
         test_data,test_label = self._preprocess('test')
-        val_iter = [[test_data[i],test_label[i]] for i in range(len(test_data))]
+        val_iter = tensor_iter(test_data,test_label,device)
         self.feature_size = train_data[0].shape[2]
 
-        encoder = Encoder(self.feature_size,self.hidden_size,self.en_cnn_k_s,self.strides,n_layers=1,dropout=0.5)
+        encoder = Encoder(self.feature_size,self.hidden_size,self.en_cnn_k_s,self.strides,n_layers=1,dropout=0.5,
+                          bidirectional=not self.causal)
         decoder = Decoder(self.hidden_size,1,n_layers=1,dropout=0.5)
-        seq2seq = Seq2Seq(encoder,decoder).to(device)
+        seq2seq = Seq2Seq(encoder,decoder,attention_window=self.attention_window,causal=self.causal).to(device)
         # seq2seq = torch.load('./model/newest_seq2seq')
         seq2seq.teacher_forcing_ratio = 0.3
         optimizer = optim.Adam(seq2seq.parameters(), lr=self.lr)
@@ -191,7 +334,8 @@ class RUL():
         e0 = 30
         best_loss = 1
         for e in range(1, self.epochs+1):
-            train_loss = self._fit(e, seq2seq, optimizer, train_iter, grad_clip=10.0)
+            train_loss = fit_epoch(seq2seq, optimizer, train_iter, self.strides, self.batch_size, self.bucket,
+                                   grad_clip=10.0)
             val_loss = self._evaluate(seq2seq, train_iter)
             test_loss,er = self._evaluate(seq2seq, val_iter, cal_er=True)
             score = self._cal_score(er)
@@ -244,42 +388,63 @@ class RUL():
 
     def test(self):
         train_data,train_label = self._preprocess('train')
-        train_iter = [[train_data[i],train_label[i]] for i in range(len(train_data))]
+        train_iter = tensor_iter(train_data,train_label,device)
         test_data,test_label = self._preprocess('test')
-        val_iter = [[test_data[i],test_label[i]] for i in range(len(test_data))]
+        val_iter = tensor_iter(test_data,test_label,device)
 
         seq2seq = torch.load('./model/best_seq2seq')
         self._plot_result(seq2seq, train_iter, val_iter)
     
     def online_test(self):
         test_data,test_label = self._preprocess('test')
-        val_iter = [[test_data[i],test_label[i]] for i in range(len(test_data))]
+        val_iter = tensor_iter(test_data,test_label,device)
 
         seq2seq = torch.load('./model/1-2_continue_best_score_seq2seq')
         seq2seq.eval()
 
         online_analyse = OrderedDict()
         online_analyse['test_label'] = test_label
-        online_analyse['test_result'] = []
 
+        # five suffixes of every bearing, all of them run in padded batches
+        pairs = []
+        for [data, label] in val_iter:
+            for i in range(5):
+                pairs.append([data[round(i*data.shape[0]/5):,], label[round(i*label.shape[0]/5):,]])
+        online_analyse['test_result'] = [None] * len(pairs)
         with torch.no_grad():
-            for [data, label] in val_iter:
-                for i in range(5):
-                    t_data, t_label = torch.from_numpy(data[round(i*data.shape[0]/5):,].copy()), torch.from_numpy(label[round(i*label.shape[0]/5):,].copy())
-                    t_data, t_label = t_data.type(torch.FloatTensor), t_label.type(torch.FloatTensor)
-                    t_data = Variable(t_data).to(device)
-                    t_label = Variable(t_label).to(device)
-                    output = seq2seq(t_data, t_label, teacher_forcing_ratio=0.0)
-                    online_analyse['test_result'].append(output.data.cpu().numpy())
+            for index, output, _, len_label in eval_batches(seq2seq, pairs, self.eval_batch_size):
+                for b,j in enumerate(index):
+                    online_analyse['test_result'][j] = output[:len_label[b], b:b+1].data.cpu().numpy()
         
         sio.savemat('online_test.mat',online_analyse)
 
+    def stream_test(self):
+        # snapshots of the test bearings arrive one by one, the model should be trained with causal=True
+        test_data,test_label = self._preprocess('test')
+        val_iter = tensor_iter(test_data,test_label,device)
+
+        seq2seq = torch.load('./model/best_seq2seq')
+        seq2seq.eval()
+        stream = StreamingSeq2Seq(seq2seq)
+
+        stream_analyse = OrderedDict()
+        stream_analyse['test_label'] = test_label
+        stream_analyse['test_result'] = []
+
+        with torch.no_grad():
+            for [data, _] in val_iter:
+                stream.reset()
+                output = torch.cat([stream.update(data[i:i+1]) for i in range(data.shape[0])], 0)
+                stream_analyse['test_result'].append(output.data.cpu().numpy())
+
+        sio.savemat('stream_test.mat',stream_analyse)
+
     def analyse(self):
         analyse_data = OrderedDict()
         train_data, train_data_no_norm, train_label = self._preprocess('train',is_analyse=True)
-        train_iter = [[train_data[i],train_label[i]] for i in range(len(train_data))]
+        train_iter = tensor_iter(train_data,train_label,device)
         test_data, test_data_no_norm, test_label = self._preprocess('test',is_analyse=True)
-        val_iter = [[test_data[i],test_label[i]] for i in range(len(test_data))]
+        val_iter = tensor_iter(test_data,test_label,device)
 
         analyse_data['train_data'] = train_data
         analyse_data['train_data_no_norm'] = train_data_no_norm
@@ -293,62 +458,35 @@ class RUL():
 
         analyse_data['train_fea_after_encoder'] = []
         analyse_data['train_atten'] = []
+        analyse_data['train_atten_start'] = []
         analyse_data['train_result'] = []
 
         with torch.no_grad():
             for [data, label] in train_iter:
-                data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-                data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-                data = Variable(data).to(device)
-                label = Variable(label).to(device)
                 output, temp_analyse_data = seq2seq(data, label, teacher_forcing_ratio=0.0, is_analyse=True)
                 analyse_data['train_result'].append(output.data.cpu().numpy())
                 analyse_data['train_fea_after_encoder'].append(temp_analyse_data['fea_after_encoder'])
                 analyse_data['train_atten'].append(temp_analyse_data['atten'])
+                analyse_data['train_atten_start'].append(temp_analyse_data['atten_start'])
 
         analyse_data['test_fea_after_encoder'] = []
         analyse_data['test_atten'] = []
+        analyse_data['test_atten_start'] = []
         analyse_data['test_result'] = []
 
         with torch.no_grad():
             for [data, label] in val_iter:
-                data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-                data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-                data = Variable(data).to(device)
-                label = Variable(label).to(device)
                 output, temp_analyse_data = seq2seq(data, label, teacher_forcing_ratio=0.0, is_analyse=True)
                 analyse_data['test_result'].append(output.data.cpu().numpy())
                 analyse_data['test_fea_after_encoder'].append(temp_analyse_data['fea_after_encoder'])
                 analyse_data['test_atten'].append(temp_analyse_data['atten'])
+                analyse_data['test_atten_start'].append(temp_analyse_data['atten_start'])
 
         sio.savemat('analyse_data.mat',analyse_data)
         
     def _evaluate(self, model, val_iter, cal_er=False):
-        model.eval()
-        total_loss = 0
-        er = []
-        for [data, label] in val_iter:
-            with torch.no_grad():
-                data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-                data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-                data = Variable(data).to(device)
-                label = Variable(label).to(device)
-                output = model(data, label, teacher_forcing_ratio=0.0)
-                if cal_er:
-                    label_n = label.data.cpu().numpy().reshape(-1,)
-                    output_n = output.data.cpu().numpy().reshape(-1,)
-                    x = np.arange(label_n.shape[0]) * self.strides
-                    er.append(list(map(lambda x:x[1]/x[0],[np.polyfit(x,label_n,1),np.polyfit(x[5:],output_n[5:],1)])))
-            loss = F.mse_loss(output,label)
-            # loss = F.l1_loss(output,label)
-            total_loss += loss.data  
-        if cal_er:
-            er = list(map(lambda x:(x[0] - x[1]) / x[0], er))
-            return total_loss/len(val_iter), np.array(er)
-        else:
-            return total_loss / len(val_iter)
+        return evaluate(model, val_iter, self.strides, cal_er, self.eval_batch_size, trim=(5,0), causal=self.causal)
 
-    
     def _cal_score(self, er):
         '''
         er: a numpy array
@@ -356,28 +494,6 @@ class RUL():
         return np.exp(np.log(.5)*er*(np.sign(er)*12.5-7.5))
 
 
-    def _fit(self, e, model, optimizer, train_iter, grad_clip=10.0):
-        model.train()
-        total_loss = 0
-        random.shuffle(train_iter)
-        for [data, label] in train_iter:
-            random_idx = random.randint(0,round(label.shape[0]*0.3))
-            data, label = data[random_idx*self.strides:,], label[random_idx:,]
-            data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-            data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-            data, label = Variable(data).to(device), Variable(label).to(device)
-            optimizer.zero_grad()
-            output = model(data, label)
-            loss = F.mse_loss(output,label)
-            # loss = F.l1_loss(output,label)
-            loss.backward()
-            clip_grad_norm_(model.parameters(), grad_clip)
-            optimizer.step()
-            total_loss += loss.data
-            # torch.cuda.empty_cache()        #empty useless variable
-        return total_loss / len(train_iter)
-
-
     def _plot_result(self, model, train_iter, val_iter):
         model.eval()
 
@@ -385,10 +501,6 @@ class RUL():
         outputs = []
         with torch.no_grad():
             for [data, label] in train_iter:
-                data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-                data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-                data = Variable(data).to(device)
-                label = Variable(label).to(device)
                 output = model(data, label, teacher_forcing_ratio=0.0)
                 labels.append(label.data.cpu().numpy())
                 outputs.append(output.data.cpu().numpy())
@@ -403,10 +515,6 @@ class RUL():
         outputs = []
         with torch.no_grad():
             for [data, label] in val_iter:
-                data, label = torch.from_numpy(data.copy()), torch.from_numpy(label.copy())
-                data, label = data.type(torch.FloatTensor), label.type(torch.FloatTensor)
-                data = Variable(data).to(device)
-                label = Variable(label).to(device)
                 output = model(data, label, teacher_forcing_ratio=0.0)
                 labels.append(label.data.cpu().numpy())
                 outputs.append(output.data.cpu().numpy())
@@ -422,118 +530,33 @@ class RUL():
     def _preprocess(self, select, is_analyse=False):
         fea_type='fre'
         if select == 'train':
-            temp_data = self.dataset.get_value('data',condition={'bearing_name':self.train_bearings})
-            temp_label = self.dataset.get_value('RUL',condition={'bearing_name':self.train_bearings})
+            bearings = self.train_bearings
         elif select == 'test':
-            temp_data = self.dataset.get_value('data',condition={'bearing_name':self.test_bearings})
-            temp_label = self.dataset.get_value('RUL',condition={'bearing_name':self.test_bearings})
+            bearings = self.test_bearings
         else:
             raise ValueError('wrong selection!')
 
-        for i,x in enumerate(temp_label):
-            temp_label[i] = np.arange(temp_data[i].shape[0]) + x
-            temp_label[i] = temp_label[i][:,np.newaxis,np.newaxis]
-            temp_label[i] = temp_label[i] / np.max(temp_label[i])
-            temp_label[i] = temp_label[i][:-self.en_cnn_k_s:self.strides] # when chang 10
-        for i,x in enumerate(temp_data):
-            temp_data[i] = x[::-1,].transpose(0,2,1)
-        
-        if fea_type == 'time':
-            temp_fun = self._get_time_fea
-        elif fea_type == 'fre':
-            temp_fun = self._get_fre_fea
-        elif fea_type == 'all':
-            temp_fun = [self._get_time_fea, self._get_fre_fea]
-        else:
-            raise ValueError('error selection for features!')
-
-        if isinstance(temp_fun,list):
-            r_fea = []
-            for func in temp_fun:
-                r_fea.append([func(x) for x in temp_data])
-            r_fea = [np.concatenate((r_fea[j][i] for j in range(len(r_fea))),axis=2) for i in range(len(r_fea[0]))]
-        else:
-            r_fea = [temp_fun(x) for x in temp_data]
-
+        extractors = feature_extractors(fea_type,self.time_features,self.band_edges,self.fs,self.fault_frequencies,
+                                        self.envelope_harmonics,self.envelope_bandwidth,self.wpt_level)
+        # features are cached without normalization, both outputs of analyse come from one extraction
+        features, temp_label = bearing_features(self.dataset,bearings,extractors,self.strides,self.en_cnn_k_s,
+                                                self.feature_cache,self.feature_backend,self.n_workers,self.causal)
+        r_fea_no_norm = [np.concatenate(x,axis=2) for x in features]
+        scaler = None
+        if self.scaler is not None:
+            # fitted on the training features and saved with the models, the others load it. The
+            # scaler is keyed by the snapshot counts of the training bearings instead of the dataset
+            # fingerprint, so appending snapshots to other bearings does not refit it
+            scaler = training_scaler(self.scaler,self.scaler_dir,'best_attention',
+                                     (bearing_counts(self.dataset,self.train_bearings),fea_type,extractors,
+                                      self.feature_backend),
+                                     fea=r_fea_no_norm if select == 'train' else None,
+                                     fit=lambda: self._preprocess('train'))
+        r_fea = scale_features(features,scaler)
         if is_analyse:
-            if isinstance(temp_fun,list):
-                r_fea_no_norm = []
-                for func in temp_fun:
-                    r_fea_no_norm.append([func(x,is_norm=False) for x in temp_data])
-                r_fea_no_norm = [np.concatenate((r_fea[j][i] for j in range(len(r_fea))),axis=2) for i in range(len(r_fea[0]))]
-            else:
-                r_fea_no_norm = [temp_fun(x,is_norm=False) for x in temp_data]
             return r_fea, r_fea_no_norm, temp_label
         else:
             return r_fea, temp_label
-        
-        #     r_feature = [self._get_time_fea(x) for x in temp_data]
-
-        # time_feature = [self._get_time_fea(x) for x in temp_data]
-        # fre_feature = [self._get_fre_fea(x) for x in temp_data]
-        # r_feature = [np.concatenate((time_feature[i],fre_feature[i]),axis=2) for i in range(len(time_feature))]
-        # if is_analyse:
-        #     time_fea_no_norm = [self._get_time_fea(x,is_norm=False) for x in temp_data]
-        #     fre_fea_no_norm = [self._get_fre_fea(x,is_norm=False) for x in temp_data]
-        #     r_fea_no_norm = [np.concatenate((time_fea_no_norm[i],fre_fea_no_norm[i]),axis=2) for i in range(len(time_fea_no_norm))]
-        #     return r_feature, r_fea_no_norm, temp_label
-        # else:
-        #     return r_feature, temp_label
-
-    def _get_time_fea(self, data, is_norm=True):
-        fea_dict = OrderedDict()
-        fea_dict['mean'] = np.mean(data,axis=2,keepdims=True)
-        fea_dict['rms'] = np.sqrt(np.mean(data**2,axis=2,keepdims=True))
-        fea_dict['kur'] = np.sum((data-fea_dict['mean'].repeat(data.shape[2],axis=2))**4,axis=2) \
-                / (np.var(data,axis=2)**2*data.shape[2])
-        fea_dict['kur'] = fea_dict['kur'][:,:,np.newaxis]
-        fea_dict['skew'] = np.sum((data-fea_dict['mean'].repeat(data.shape[2],axis=2))**3,axis=2) \
-                / (np.var(data,axis=2)**(3/2)*data.shape[2])
-        fea_dict['skew'] = fea_dict['skew'][:,:,np.newaxis]
-        fea_dict['p2p'] = np.max(data,axis=2,keepdims=True) - np.min(data,axis=2,keepdims=True)
-        fea_dict['var'] = np.var(data,axis=2,keepdims=True)
-        fea_dict['cre'] = np.max(abs(data),axis=2,keepdims=True) / fea_dict['rms']
-        fea_dict['imp'] = np.max(abs(data),axis=2,keepdims=True) \
-                / np.mean(abs(data),axis=2,keepdims=True)
-        fea_dict['mar'] = np.max(abs(data),axis=2,keepdims=True) \
-                / (np.mean((abs(data))**0.5,axis=2,keepdims=True))**2
-        fea_dict['sha'] = fea_dict['rms'] / np.mean(abs(data),axis=2,keepdims=True)
-        fea_dict['smr'] = (np.mean((abs(data))**0.5,axis=2,keepdims=True))**2
-        fea_dict['cle'] = fea_dict['p2p'] / fea_dict['smr']
-
-        fea = np.concatenate(tuple(x for x in fea_dict.values()),axis=2)
-        fea = fea.reshape(-1,fea.shape[1]*fea.shape[2])
-        # self.feature_size = fea.shape[1]
-        if is_norm:
-            fea = self._normalize(fea,dim=1)
-        fea = fea[:,np.newaxis,:]
-        return fea
-    
-    def _get_fre_fea(self, data, is_norm=True):
-        fft_data = np.fft.fft(data,axis=2)/data.shape[2]
-        fft_data = (np.abs(fft_data))**2
-        fea_list = []
-        for i in range(5):
-            fea_list.append(np.sum(fft_data[:,:,i*256:(i+1)*256],axis=2,keepdims=True))
-        fea = np.concatenate(fea_list,axis=2)
-        fea = fea.reshape(-1,fea.shape[1]*fea.shape[2])
-        # self.feature_size = fea.shape[1]
-        if is_norm:
-            fea = self._normalize(fea,dim=1)
-        fea = fea[:,np.newaxis,:]
-        return fea
-
-
-    def _normalize(self, data, dim=None):
-        if dim == None:
-            mmrange = 10.**np.ceil(np.log10(np.max(data) - np.min(data)))
-            r_data = (data - np.min(data)) / mmrange
-        else:
-            # mmrange = 10.**np.ceil(np.log10(np.max(data,axis=dim,keepdims=True) - np.min(data,axis=dim,keepdims=True)))
-            mmrange = np.max(data,axis=dim,keepdims=True) - np.min(data,axis=dim,keepdims=True)
-            r_data = (data - np.min(data,axis=dim,keepdims=True).repeat(data.shape[dim],axis=dim)) \
-                / (mmrange).repeat(data.shape[dim],axis=dim)
-        return r_data
 
 
 if __name__ == '__main__':
@@ -11,10 +11,10 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 class CNN_GRU():
-    def __init__(self):
+    def __init__(self,cache=False):
         self.input_shape = (2560,2)
         self.feature_size = 16
-        self.dataset = DataSet.load_dataset(name='phm_data')
+        self.dataset = DataSet.load_dataset(name='phm_data',cache=cache)
         self.train_bearings = ['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']
         self.test_bearings = ['Bearing1_3','Bearing1_4','Bearing1_5','Bearing1_6','Bearing1_7',
                                 'Bearing2_3','Bearing2_4','Bearing2_5','Bearing2_6','Bearing2_7',
@@ -4,6 +4,7 @@ import random
 import matplotlib.pyplot as plt
 from collections import OrderedDict
 from dataset import DataSet
+from feature import half_spectrum
 import torch
 from torch import nn, optim
 from torch.autograd import Variable
@@ -263,9 +264,9 @@ class Custom_loss(nn.Module):
         return torch.mean((pred-tru)**2/(tru+1))
 
 class CNN_GRU():
-    def __init__(self):
+    def __init__(self,cache=False):
         self.feature_size = 8
-        self.dataset = DataSet.load_dataset(name='phm_data')
+        self.dataset = DataSet.load_dataset(name='phm_data',cache=cache)
         self.train_bearings = ['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']
         self.test_bearings = ['Bearing1_3','Bearing1_4','Bearing1_5','Bearing1_6','Bearing1_7',
                                 'Bearing2_3','Bearing2_4','Bearing2_5','Bearing2_6','Bearing2_7',
@@ -318,14 +319,15 @@ class CNN_GRU():
         return model
 
     def _normalize(self,data):
-        r_data = np.zeros_like(data)
-        for i in range(r_data.shape[0]):
-            r_data[i,] = ((data[i]-np.min(data[i]))/(np.max(data[i])-np.min(data[i]))-0.5)*2
-        return r_data
+        axis = tuple(range(1,data.ndim))
+        d_min = np.min(data,axis=axis,keepdims=True)
+        d_max = np.max(data,axis=axis,keepdims=True)
+        r_data = ((data-d_min)/(d_max-d_min)-0.5)*2
+        return r_data.astype(data.dtype,copy=False)
 
     def _fft(self,data):
-        fft_data = np.fft.fft(data,axis=2)/data.shape[2]
-        r_fft_data = np.append(fft_data[:,:,0:int(data.shape[2]/2)].real,fft_data[:,:,0:int(data.shape[2]/2)].imag,axis=1)
+        fft_data = half_spectrum(data)
+        r_fft_data = np.concatenate((fft_data.real,fft_data.imag),axis=1)
         return r_fft_data
 
     def _add_noise(self,data,snr=0):
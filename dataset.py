@@ -7,14 +7,23 @@ TODO
     should class DataSet only arange, save and load?
 """
 
+import io
 import os
+import mmap
+import shutil
+import hashlib
 import operator
+import sys
 import random
+import threading
 import scipy.io as sio
 import pickle as pickle
 import numpy as np
 import pandas as pd
 from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 
 class DataSet(object):
     '''This class is used to arrange dataset, collected and used by Lab 119 in HIT.
@@ -25,13 +34,64 @@ class DataSet(object):
             index: A list contained atrributes of the dataset, so that samples can be distinguished 
                 from each others by different values under same attributes.
             save_path: A string described where to save or load this dataset, and defaulted as './data/'
-            dataset: A list contained samples and their attributes.
+            dataset: A list contained samples and their attributes. The values are stored by columns,
+                one column per attribute in index (see _Column), and dataset is a view of the columns
+                by samples. Assigning a list of samples to dataset rebuilds the columns.
     '''
-    def __init__(self,name='',index=[],save_path='./data/',dataset=[]):
+    def __init__(self,name='',index=None,save_path='./data/',dataset=None):
         self.name = name
-        self.index = index
+        self.index = [] if index is None else index
         self.save_path = save_path
-        self.dataset = dataset
+        self.dataset = [] if dataset is None else dataset
+
+    @property
+    def dataset(self):
+        return _Rows(self)
+
+    @dataset.setter
+    def dataset(self,samples):
+        samples = [list(x) for x in samples]
+        for x in samples:
+            if len(x) != len(self.index):
+                raise ValueError('samples should have the same number of attributes as index!')
+        self._set_columns([_Column([x[i] for x in samples]) for i in range(len(self.index))],len(samples))
+
+    @staticmethod
+    def _from_columns(name,index,save_path,columns):
+        '''
+        Build a DataSet from a list of values per attribute, without going through samples.
+        '''
+        r_dataset = DataSet(name=name,index=index,save_path=save_path)
+        r_dataset._set_columns([x if isinstance(x,_Column) else _Column(x) for x in columns],
+                               len(columns[0]) if len(columns) > 0 else 0)
+        return r_dataset
+
+    def _set_columns(self,columns,quantity):
+        self._columns = columns
+        self._quantity = quantity
+        self._reset_inverted_index()
+
+    def __len__(self):
+        return self._quantity
+
+    def __getstate__(self):
+        state = OrderedDict()
+        state['name'] = self.name
+        state['index'] = self.index
+        state['save_path'] = self.save_path
+        state['columns'] = [x.values() for x in self._columns]
+        state['quantity'] = self._quantity
+        return state
+
+    def __setstate__(self,state):
+        self.name = state['name']
+        self.index = state['index']
+        self.save_path = state['save_path']
+        if 'dataset' in state:
+            # DataSet pickled with samples as lists
+            self.dataset = state['dataset']
+        else:
+            self._set_columns([_Column.from_array(x) for x in state['columns']],state['quantity'])
 
     # inner function
     def _deal_condition(self,condition):
@@ -40,23 +100,124 @@ class DataSet(object):
 
         Args:
             condition: A dict whose keys are the name of attributes and values are lists contained values owned by 
-                samples we need.
+                samples we need. A sample is needed if its values are in the lists under all keys.
         Return:
-            A bool list whether the sample need according to condition.
+            A bool numpy array whether the sample need according to condition.
         '''
-        conforming_idx_all = []
-        for k in condition.keys():
-            value_attribute = self.get_value_attribute(k)
-            conforming_idx_all.append([x in condition[k] for x in value_attribute])
-        conforming_idx = [True]*len(self.dataset)
-        for x in conforming_idx_all:
-            conforming_idx = conforming_idx and x
+        conforming_idx = np.zeros(len(self),dtype=bool)
+        conforming_idx[self._conforming_rows(condition)] = True
         return conforming_idx
 
+    def _conforming_rows(self,condition):
+        '''
+        get the positions of samples whose attributes is in condition. Each attribute in condition
+        is looked up in its inverted index, and the positions under all attributes are intersected.
+
+        Args:
+            condition: The same as _deal_condition.
+        Return:
+            A sorted numpy array of positions of samples.
+        '''
+        if len(condition) == 0:
+            return np.arange(len(self))
+        postings = []
+        for k in condition.keys():
+            k_rows = self._attribute_rows(k,condition[k])
+            if k_rows.size == 0:
+                return k_rows
+            postings.append(k_rows)
+        # the smallest postings are intersected first, so the cost follows the matches instead of
+        # the number of samples
+        postings.sort(key=len)
+        rows = postings[0]
+        for k_rows in postings[1:]:
+            rows = np.intersect1d(rows,k_rows,assume_unique=True)
+            if rows.size == 0:
+                break
+        return rows
+
+    def _attribute_rows(self,attribute,values):
+        '''
+        get the positions of samples whose attribute is in values, by the inverted index if possible.
+
+        Return:
+            A sorted numpy array of unique positions.
+        '''
+        if not isinstance(values,(list,tuple,set,np.ndarray)):
+            values = [values]
+        inverted_index = self._get_inverted_index(attribute)
+        k_rows = None
+        if inverted_index is not None:
+            k_rows = []
+            try:
+                for x in values:
+                    k_rows.append(inverted_index.get(x,[]))
+            except TypeError:
+                # unhashable value, which can only be found by comparing one by one
+                k_rows = None
+        if k_rows is None:
+            return np.array([i for i,x in enumerate(self.get_value_attribute(attribute)) if x in values],dtype=int)
+        if len(k_rows) == 1:
+            # the positions of a value are appended in order
+            return np.array(k_rows[0],dtype=int)
+        # values of a condition may repeat or be equal (such as 1 and 1.0)
+        return np.unique(np.concatenate([np.array(x,dtype=int) for x in k_rows]))
+
+    def _reset_inverted_index(self):
+        '''
+        Drop all inverted indexes, which are built again when needed. It should be called when
+        samples are removed or reordered.
+        '''
+        self._inverted_index = {}
+
+    def _get_inverted_index(self,attribute):
+        '''
+        get the inverted index of an attribute, which is built at the first time.
+
+        Args:
+            attribute: A str mapping the attribute of dataset.
+        Return:
+            A dict like {value:[positions of samples with this value]}, or None if some values are
+            not hashable (such as lists and arrays).
+        '''
+        if attribute not in self._inverted_index:
+            inverted_index = {}
+            try:
+                for i,x in enumerate(self.get_value_attribute(attribute)):
+                    inverted_index.setdefault(x,[]).append(i)
+            except TypeError:
+                inverted_index = None
+            self._inverted_index[attribute] = inverted_index
+        return self._inverted_index[attribute]
+
+    def _update_inverted_index(self,sample):
+        '''
+        Add the last appended sample into the inverted indexes already built.
+        '''
+        for attribute,inverted_index in self._inverted_index.items():
+            if inverted_index is None:
+                continue
+            try:
+                inverted_index.setdefault(sample[self.index.index(attribute)],[]).append(len(self) - 1)
+            except TypeError:
+                self._inverted_index[attribute] = None
+
+    def _take(self,rows):
+        '''
+        get a DataSet contained samples at the given positions, the arrays in samples are not copied.
+        '''
+        return DataSet._from_columns('temp',list(self.index),self.save_path,[x.take(rows) for x in self._columns])
+
+    def _set_value(self,i,attribute_idx,value):
+        self._columns[attribute_idx][i] = value
+        self._inverted_index.pop(self.index[attribute_idx],None)
+
     # modify
     def reset_index(self,index):
         assert isinstance(index,list)
+        assert len(index) == len(self._columns)
         self.index = index
+        self._reset_inverted_index()
 
     def add_index(self,new_attribute,new_value=None):
         '''
@@ -71,19 +232,15 @@ class DataSet(object):
         Return:
             None
         '''
+        if new_value is None:
+            new_value = [None]*len(self)
+        elif isinstance(new_value,list) and len(new_value) == 1:
+            new_value = new_value*len(self)
+        elif not isinstance(new_value,list) or len(new_value) != len(self):
+            raise TypeError
         self.index.append(new_attribute)
-        if new_value == None:
-            for x in self.dataset:
-                x.append(new_value)
-        elif isinstance(new_value,list):
-            if len(new_value) == 1:
-                for i in range(len(self.dataset)):
-                    self.dataset[i].append(new_value[0])
-            elif len(new_value) == len(self.dataset):
-                for i in range(len(self.dataset)):
-                    self.dataset[i].append(new_value[i])
-            else:
-                raise TypeError
+        self._columns.append(_Column(new_value))
+        self._inverted_index.pop(new_attribute,None)
 
     def del_index(self,del_attribute):
         '''
@@ -96,9 +253,9 @@ class DataSet(object):
         '''
         try:
             idx = self.index.index(del_attribute)
-            for x in self.dataset:
-                del(x[idx])
+            del(self._columns[idx])
             self.index.remove(del_attribute)
+            self._inverted_index.pop(del_attribute,None)
         except ValueError:
             raise ValueError
             print('The given attribute does not exist in index, and the attributes of this dataset \
@@ -121,16 +278,19 @@ class DataSet(object):
                         append_data_list.append(append_data[x])
                     else:
                         append_data_list.append(None)
-                self.dataset.append(append_data_list)
             else:
                 raise ValueError('append_data has too much attribute!')
         elif isinstance(append_data,list):
             if len(append_data) == len(self.index):
-                self.dataset.append(append_data)
+                append_data_list = append_data
             else:
                 raise ValueError('append_data has wrong number of attribute!')
         else:
             raise TypeError('append_data should be dict or list')
+        for i,x in enumerate(append_data_list):
+            self._columns[i].append(x)
+        self._quantity += 1
+        self._update_inverted_index(append_data_list)
 
     def delete(self,condition):
         '''
@@ -142,9 +302,8 @@ class DataSet(object):
             None
         '''
         conforming_idx = self._deal_condition(condition)
-        for i,x in enumerate(self.dataset):
-            if conforming_idx[i]:
-                self.dataset.pop(x)
+        rows = np.flatnonzero(~conforming_idx)
+        self._set_columns([x.take(rows) for x in self._columns],rows.size)
 
     # get information or values
     def get_value_attribute(self,attribute):
@@ -159,7 +318,7 @@ class DataSet(object):
         '''
         try:
             idx = self.index.index(attribute)
-            return [x[idx] for x in self.dataset]
+            return self._columns[idx].tolist()
         except ValueError:
             raise ValueError
             print('The given attribute does not exist in index, and the attributes of this dataset \
@@ -175,9 +334,26 @@ class DataSet(object):
         Return:
             A list contrained values by given attribute and condition.
         '''
-        conforming_idx = self._deal_condition(condition)
         idx = self.index.index(attribute)
-        return [x[idx] for i,x in enumerate(self.dataset) if conforming_idx[i]]
+        if len(condition) == 0:
+            return self._columns[idx].tolist()
+        return self._columns[idx].take(self._conforming_rows(condition)).tolist()
+
+    def get_column(self,attribute,condition={}):
+        '''
+        get corresponding values as a numpy array. Numbers, bools and strings are returned as typed
+        arrays and others (such as signals) as an object array.
+
+        Args:
+            attribute: A string describes the values returned.
+            condition: A dict determines the values of which samples should be returned.
+        Return:
+            A numpy array. Without condition, it is a view of the column and should not be modified.
+        '''
+        idx = self.index.index(attribute)
+        if len(condition) == 0:
+            return self._columns[idx].values()
+        return self._columns[idx].values()[self._conforming_rows(condition)]
 
     def get_dataset(self,condition={}):
         '''
@@ -188,9 +364,7 @@ class DataSet(object):
         Return:
             A DataSet contrained values by given condition.
         '''
-        conforming_idx = self._deal_condition(condition)
-        return DataSet(name='temp',index=self.index,
-                        dataset=[x for i,x in enumerate(self.dataset) if conforming_idx[i]])
+        return self._take(self._conforming_rows(condition))
 
     def get_random_choice(self):
         '''
@@ -202,9 +376,9 @@ class DataSet(object):
             A dict like {Attribute_1:Values,...}.
         '''
         r = {}
-        data = random.choice(self.dataset)
-        for i,k in enumerate(self.index):
-            r[k] = data[i]
+        i = random.randrange(len(self))
+        for j,k in enumerate(self.index):
+            r[k] = self._columns[j][i]
         return r
 
     def get_random_samples(self,n=1):
@@ -216,78 +390,222 @@ class DataSet(object):
         Return:
             A Dataset with same index but only one sample.
         '''
-        return DataSet(name='temp',index=self.index,dataset=random.sample(self.dataset,n))
+        return self._take(random.sample(range(len(self)),n))
     
     # value process
-    def normalization(self,attribute,select='std'):
+    def normalization(self,attribute,select='std',mode='row',dtype=None,stats=None,chunk_size=1024):
+        '''
+        Normalize arrays of the attribute. Statistics are accumulated over chunks of the first axis in
+        one pass, and the arrays are overwritten chunk by chunk, so no full-size temporary is made.
+        The arrays are modified in place if they are writable and already of the output dtype,
+        otherwise new arrays are allocated. Arrays without values (such as a bearing without
+        snapshots) are left as they are, and their statistics of mode 'row' are nan.
+
+        Args:
+            attribute: The attribute to normalize.
+            select: 'std' (x-mean)/std, 'min-max' (x-mean)/max|x-mean| or 'fft' x/max.
+            mode: 'row' normalizes each sample (such as a bearing) as a whole, 'snapshot' normalizes
+                each sub-array of the first axis of the samples, and 'fitted' normalizes all samples
+                with the same statistics, fitted on the column or given by stats.
+            dtype: The dtype of output arrays, such as np.float32. Defaulted as the dtype of input
+                arrays (float64 for integers).
+            stats: The statistics returned by normalization with mode 'fitted', for normalizing new
+                data as the data fitted before.
+            chunk_size: The length of the chunks of the first axis.
+        Return:
+            The statistics (shift,scale) used. A tuple for mode 'fitted', and a list per sample for
+            other modes, in which the statistics of mode 'snapshot' are arrays.
+        '''
+        if select not in ['std','min-max','fft']:
+            raise ValueError('select should be \'std\', \'min-max\' or \'fft\'!')
+        if mode not in ['row','snapshot','fitted']:
+            raise ValueError('mode should be \'row\', \'snapshot\' or \'fitted\'!')
+        if stats is not None and mode != 'fitted':
+            raise ValueError('stats can only be given with mode \'fitted\'!')
         idx = self.index.index(attribute)
-        for i in range(len(self.dataset)):
-            if select == 'fft':
-                self.dataset[i][idx] = self.dataset[i][idx] / np.max(self.dataset[i][idx])
+        column = self._columns[idx]
+        if mode == 'fitted' and stats is None:
+            moments = None
+            for i in range(len(self)):
+                moments = _merge_moments(moments,_array_moments(column[i],chunk_size))
+            if moments is None:
+                raise ValueError('attribute ' + str(attribute) + ' has no values to fit!')
+            stats = _moment_stats(moments,select)
+
+        r_stats = []
+        for i in range(len(self)):
+            x = np.asarray(column[i])
+            out_dtype = np.dtype(dtype) if dtype is not None else \
+                        (x.dtype if x.dtype.kind in 'fc' else np.dtype(np.float64))
+            if x.dtype == out_dtype and x.flags.writeable:
+                out = x
             else:
-                self.dataset[i][idx] = self.dataset[i][idx] - np.mean(self.dataset[i][idx])
-                if select == 'min-max':
-                    self.dataset[i][idx] = self.dataset[i][idx] / max(np.max(self.dataset[i][idx]),abs(np.min(self.dataset[i][idx])))
-                elif select == 'std':
-                    self.dataset[i][idx] = self.dataset[i][idx] / np.std(self.dataset[i][idx])
+                out = np.empty(x.shape,dtype=out_dtype)
+            if mode == 'row':
+                shift,scale = _moment_stats(_array_moments(x,chunk_size),select) if x.size > 0 else \
+                              (np.nan,np.nan)
+            elif mode == 'fitted':
+                shift,scale = stats
+            else:
+                if x.ndim < 2:
+                    raise ValueError('mode \'snapshot\' needs arrays of at least 2 dimensions!')
+                shift,scale = np.empty(len(x)),np.empty(len(x))
+            for start in range(0,len(x) if x.size > 0 else 0,chunk_size):
+                x_chunk,out_chunk = x[start:start+chunk_size],out[start:start+chunk_size]
+                if mode == 'snapshot':
+                    moments = _array_moments(x_chunk,chunk_size,axis=tuple(range(1,x.ndim)))
+                    chunk_shift,chunk_scale = _moment_stats(moments,select)
+                    shift[start:start+chunk_size],scale[start:start+chunk_size] = chunk_shift,chunk_scale
+                    chunk_shift = chunk_shift.reshape((-1,)+(1,)*(x.ndim-1))
+                    chunk_scale = chunk_scale.reshape((-1,)+(1,)*(x.ndim-1))
                 else:
-                    raise ValueError
+                    chunk_shift,chunk_scale = shift,scale
+                np.subtract(x_chunk,chunk_shift,out=out_chunk,casting='unsafe')
+                np.divide(out_chunk,chunk_scale,out=out_chunk,casting='unsafe')
+            if out is not x:
+                column[i] = out
+            r_stats.append((shift,scale))
+        self._inverted_index.pop(attribute,None)
+        return stats if mode == 'fitted' else r_stats
 
     # class operation
     def shuffle(self):
-        random.shuffle(self.dataset)
+        rows = list(range(len(self)))
+        random.shuffle(rows)
+        self._set_columns([x.take(rows) for x in self._columns],len(rows))
 
     def random_sample(self,n):
         if isinstance(n,str):
             if n == 'all':
                 self.shuffle()
             elif n == 'half':
-                self.dataset = random.sample(self.dataset,int(len(self.dataset)/2))
+                self._set_columns(self._take(random.sample(range(len(self)),int(len(self)/2)))._columns,
+                                  int(len(self)/2))
             else:
                 raise ValueError('n should be \'all\' or \'half\'!')
         elif isinstance(n,int):
-            if n >= len(self.dataset):
+            if n >= len(self):
                 self.shuffle()
             else:
-                self.dataset = random.sample(self.dataset,n)
+                self._set_columns(self._take(random.sample(range(len(self)),n))._columns,n)
         else:
             raise TypeError('n should be int of string!')
 
     def dataset_filter(self,condition={}):
-        conforming_idx = self._deal_condition(condition)
-        self.dataset = [x for i,x in enumerate(self.dataset) if conforming_idx[i]]
+        rows = self._conforming_rows(condition)
+        self._set_columns([x.take(rows) for x in self._columns],rows.size)
 
-    def save(self):
+    def save(self,storage='npy'):
         '''
-        Save this DataSet as .pkl file.
-        
+        Save this DataSet in the save_path.
+
         Args:
-            None
+            storage: 'npy', 'shard' or 'pickle'. With 'npy' the DataSet is saved in the directory
+                'DataSet_' + name + '/', where every column of arrays (such as 'data') is written as
+                one raw .npy block and the other attributes are kept in a small header 'manifest.pkl'.
+                With 'shard' every sample is written into its own directory 'shard_xxxxx/' instead,
+                so that a condition given to load_dataset() only reads the matching shards. Both
+                are opened with np.memmap when loading, so that nothing is read from disk until the
+                arrays are touched. With 'pickle' the whole DataSet is pickled into
+                'DataSet_' + name + '.pkl' as before.
         Return:
             None
         '''
-
-        '''
         assert self.name != ''
         assert self.save_path != ''
-        pickle.dump(self, open(self.save_path + 'DataSet_' +
-                               self.name + '.pkl', 'wb'), True)
-        self._save_info()
-        print('dataset ', self.name, ' has benn saved\n')
-        '''
-
-
-        assert self.name != ''
-        assert self.save_path != ''
-        filename = self.save_path + 'DataSet_' + self.name + '.pkl'
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f, 0)
+        if storage in ['npy','shard']:
+            self._save_dir(storage)
+        elif storage == 'pickle':
+            filename = self.save_path + 'DataSet_' + self.name + '.pkl'
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as f:
+                pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        else:
+            raise ValueError('storage should be \'npy\', \'shard\' or \'pickle\'!')
 
         self._save_info()
         print('dataset ', self.name, ' has benn saved\n')
 
+    def _save_dir(self,storage):
+        '''
+        Save this DataSet as a manifest and .npy files in the directory 'DataSet_' + name + '/'.
+        With storage 'npy', a column is saved as one block if all of its values are numpy arrays
+        with the same dtype and the same shape except the first axis, and values of the i-th sample
+        are block[offsets[i]:offsets[i+1]]. With storage 'shard', a column is saved as one file per
+        sample if all of its values are numpy arrays. Other columns are kept in the manifest.
+        '''
+        dir_name = _storage_dir(self.save_path,self.name)
+        os.makedirs(dir_name, exist_ok=True)
+        manifest = OrderedDict()
+        manifest['name'] = self.name
+        manifest['index'] = list(self.index)
+        manifest['storage'] = storage
+        manifest['quantity'] = len(self)
+        manifest['columns'] = OrderedDict()
+        manifest['blocks'] = OrderedDict()
+        manifest['shards'] = OrderedDict()
+        keep = ['manifest.pkl']
+        for i,attr in enumerate(self.index):
+            values = self.get_value_attribute(attr)
+            file_name = 'column_%d.npy' % i
+            if storage == 'npy' and _is_block_column(values):
+                offsets = [0]
+                for x in values:
+                    offsets.append(offsets[-1] + x.shape[0])
+                _write_block(dir_name + file_name, values, offsets)
+                manifest['blocks'][attr] = (file_name, offsets)
+                keep.append(file_name)
+            elif storage == 'shard' and _is_shard_column(values):
+                for j,x in enumerate(values):
+                    os.makedirs(dir_name + _shard_name(j), exist_ok=True)
+                    _write_array(dir_name + _shard_name(j) + '/' + file_name, x)
+                manifest['shards'][attr] = file_name
+            else:
+                manifest['columns'][attr] = values
+        if storage == 'shard':
+            keep += [_shard_name(j) for j in range(len(self))]
+        # the manifest is replaced at last, so that it never points to a file half written
+        _write_manifest(dir_name,manifest)
+        _clean_storage_dir(dir_name, keep)
 
+    @staticmethod
+    def _load_dir(name,save_path,condition={},mmap_mode='c'):
+        '''
+        Load a DataSet saved by _save_dir.
+
+        Args:
+            name: The name of DataSet.
+            save_path: The path where the DataSet is saved.
+            condition: A dict determines which samples should be loaded. It is evaluated on the
+                manifest, so only attributes kept in the manifest can be used.
+            mmap_mode: The mode to open .npy files, see numpy.load. Defaulted as 'c' (copy-on-write),
+                so the arrays can be modified in memory without changing the files.
+        Return:
+            DataSet
+        '''
+        dir_name = _storage_dir(save_path,name)
+        manifest = _read_manifest(dir_name)
+        columns = manifest['columns']
+        for k in condition.keys():
+            if k not in columns:
+                raise ValueError('condition on ' + str(k) + ' can not be evaluated when loading, '
+                                 'the attributes in manifest are ' + str(list(columns.keys())))
+        if len(condition) > 0:
+            selected = DataSet._from_columns('temp',list(columns.keys()),save_path,
+                                             list(columns.values()))._conforming_rows(condition).tolist()
+        else:
+            selected = list(range(manifest['quantity']))
+        r_columns = OrderedDict()
+        for attr in columns.keys():
+            r_columns[attr] = [columns[attr][i] for i in selected]
+        for attr,(file_name,offsets) in manifest['blocks'].items():
+            block = np.load(dir_name + file_name, mmap_mode=mmap_mode)
+            r_columns[attr] = [block[offsets[i]:offsets[i+1]] for i in selected]
+        for attr,file_name in manifest['shards'].items():
+            r_columns[attr] = [np.load(dir_name + _shard_name(i) + '/' + file_name, mmap_mode=mmap_mode)
+                               for i in selected]
+        return DataSet._from_columns(manifest['name'],manifest['index'],save_path,
+                                     [r_columns[attr] for attr in manifest['index']])
 
     def _save_info(self):
         '''
@@ -312,12 +630,13 @@ class DataSet(object):
 
         pd.DataFrame(info).to_csv(self.save_path + 'DataSet_' + self.name + 'info.csv',index=False)
 
-    def load(self,name=''):
+    def load(self,name='',condition={}):
         '''
         Load this DataSet with name and path known, which should be given when initialize DataSet class.
         
         Args:
             name: The name of DataSet.
+            condition: A dict determines which samples should be loaded.
         Return:
             None
         '''
@@ -325,78 +644,818 @@ class DataSet(object):
             self.name = name
         assert self.name != ''
         assert self.save_path != ''
-        full_name = self.save_path + 'DataSet_' + self.name + '.pkl'
-        load_class = pickle.load(open(full_name, 'rb'))
+        load_class = DataSet._load(self.name,self.save_path,condition)
         assert load_class.name == self.name
         assert load_class.save_path == self.save_path
         print('dataset ', self.name, ' has been load')
-        self.dataset = load_class.dataset
         self.index = load_class.index
+        self._set_columns(load_class._columns,len(load_class))
 
     @staticmethod
-    def load_dataset(name):
+    def load_dataset(name,condition={},save_path='./data/',cache=False):
         '''
         Load this DataSet with name and default path './data/'.
         
         Args:
             name: The name of DataSet.
+            condition: A dict determines which samples should be loaded. If the DataSet is saved
+                with storage 'shard', only the shards of these samples are read from disk.
+            save_path: The path where the DataSet is saved.
+            cache: If True, the DataSet is kept in a process-wide cache keyed by name, save_path,
+                modified time of the saved files and condition, so loading it again (such as by
+                another model) shares the arrays instead of reading them again. The arrays of the
+                returned DataSet are read-only views, see set_dataset_cache_limit().
         Return:
             DataSet
         '''
-        save_path = './data/'
-        full_name = save_path + 'DataSet_' + name + '.pkl'
-        load_class = pickle.load(open(full_name,'rb'))
+        if cache:
+            return _load_cached(name,save_path,condition)
+        load_class = DataSet._load(name,save_path,condition)
         print('dataset ', name, ' has been load')
         return load_class
 
-def make_phm_dataset():
-    RUL_dict = {'Bearing1_1':0,'Bearing1_2':0,
-                'Bearing2_1':0,'Bearing2_2':0,
-                'Bearing3_1':0,'Bearing3_2':0,
-                'Bearing1_3':573,'Bearing1_4':33.9,'Bearing1_5':161,'Bearing1_6':146,'Bearing1_7':757,
-                'Bearing2_3':753,'Bearing2_4':139,'Bearing2_5':309,'Bearing2_6':129,'Bearing2_7':58,
-                'Bearing3_3':82}
+    @staticmethod
+    def _load(name,save_path,condition={}):
+        '''
+        Load a DataSet saved in any storage. If both a directory and a .pkl file exist, the newer
+        one is loaded.
+        '''
+        storage, full_name = _find_storage(name,save_path)
+        if storage == 'dir':
+            return DataSet._load_dir(name,save_path,condition)
+        with open(full_name, 'rb') as f:
+            load_class = pickle.load(f)
+        if len(condition) > 0:
+            load_class.dataset_filter(condition)
+        return load_class
+
+    def fingerprint(self):
+        '''
+        A hash identifying the saved files of this DataSet, which changes whenever they are saved or
+        appended again. The manifest is hashed by content, and the array files and .pkl files by
+        their sizes and modified times, so no array is read.
+
+        Args:
+            None
+        Return:
+            A hex string.
+        '''
+        storage, file_name = _find_storage(self.name,self.save_path)
+        h = hashlib.sha1(repr((self.name,list(self.index),len(self))).encode('utf-8'))
+        if storage == 'dir':
+            dir_name = _storage_dir(self.save_path,self.name)
+            with open(file_name,'rb') as f:
+                h.update(f.read())
+            for root, dirs, names in os.walk(dir_name):
+                dirs.sort()
+                for x in sorted(names):
+                    if x.endswith('.npy'):
+                        stat = os.stat(os.path.join(root,x))
+                        h.update(repr((os.path.relpath(os.path.join(root,x),dir_name),
+                                       stat.st_size,stat.st_mtime_ns)).encode('utf-8'))
+        else:
+            stat = os.stat(file_name)
+            h.update(repr((stat.st_size,stat.st_mtime_ns)).encode('utf-8'))
+        return h.hexdigest()
+
+    def to_shared_memory(self,attributes=None):
+        '''
+        Publish arrays of this DataSet in shared memory, so that processes on this host can use them
+        without copying. Arrays of every attribute are packed into one multiprocessing.shared_memory
+        block, and the other attributes are kept in the handle.
+
+        Args:
+            attributes: The attributes whose arrays are published, defaulted as every attribute of
+                which all values are numpy arrays.
+        Return:
+            SharedDataSet, a small picklable handle. Pass it to other processes and call attach()
+            there. The creating process should call unlink() when all processes have closed it.
+        '''
+        if attributes is None:
+            attributes = [x for x in self.index if _is_shard_column(self.get_value_attribute(x))]
+        for attr in attributes:
+            if not _is_shard_column(self.get_value_attribute(attr)):
+                raise ValueError('values of ' + str(attr) + ' should all be numpy arrays!')
+        columns = OrderedDict()
+        blocks = OrderedDict()
+        shms = OrderedDict()
+        try:
+            for attr in self.index:
+                values = self.get_value_attribute(attr)
+                if attr not in attributes:
+                    columns[attr] = values
+                    continue
+                offsets = [0]
+                for x in values:
+                    offsets.append(_aligned(offsets[-1] + x.nbytes))
+                shm = shared_memory.SharedMemory(create=True,size=max(offsets[-1],1))
+                shms[attr] = shm
+                for i,x in enumerate(values):
+                    np.ndarray(x.shape,dtype=x.dtype,buffer=shm.buf,offset=offsets[i])[...] = x
+                blocks[attr] = (shm.name,[x.dtype.str for x in values],[x.shape for x in values],offsets)
+        except BaseException:
+            for shm in shms.values():
+                shm.close()
+                shm.unlink()
+            raise
+        r_handle = SharedDataSet(self.name,list(self.index),self.save_path,len(self),columns,blocks)
+        r_handle._shms = shms
+        r_handle.tracker = _resource_tracker_id()
+        return r_handle
+
+class SharedDataSet(object):
+    '''
+    A handle of a DataSet published by DataSet.to_shared_memory(). It only holds the names and
+    layout of the shared memory blocks besides the small attributes, so it is cheap to pickle to
+    worker processes (such as DataLoader workers).
+    '''
+    def __init__(self,name,index,save_path,quantity,columns,blocks):
+        self.name = name
+        self.index = index
+        self.save_path = save_path
+        self.quantity = quantity
+        self.columns = columns
+        self.blocks = blocks
+        self.tracker = None # the resource tracker of the creating process, see _attach_shared_memory
+        self._shms = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shms'] = OrderedDict()
+        return state
+
+    def attach(self,writable=False):
+        '''
+        Get the DataSet whose arrays are views of the shared memory. Nothing is copied.
+
+        Args:
+            writable: Whether the arrays can be written, which changes them for every process.
+        Return:
+            DataSet
+        '''
+        columns = []
+        for attr in self.index:
+            if attr not in self.blocks:
+                columns.append(self.columns[attr])
+                continue
+            shm_name,dtypes,shapes,offsets = self.blocks[attr]
+            if attr not in self._shms:
+                self._shms[attr] = _attach_shared_memory(shm_name,self.tracker)
+            values = np.empty(self.quantity,dtype=object)
+            for i in range(self.quantity):
+                x = np.ndarray(shapes[i],dtype=np.dtype(dtypes[i]),buffer=self._shms[attr].buf,
+                               offset=offsets[i])
+                x.flags.writeable = writable
+                values[i] = x
+            columns.append(_Column.from_array(values))
+        return DataSet._from_columns(self.name,list(self.index),self.save_path,columns)
+
+    def close(self):
+        '''
+        Close the shared memory in this process. Arrays of the attached DataSet must not be used after.
+        '''
+        for shm in self._shms.values():
+            shm.close()
+        self._shms = OrderedDict()
+
+    def unlink(self):
+        '''
+        Close and free the shared memory. It should be called once, by the process creating it.
+        '''
+        shms = [self._shms.get(attr) or shared_memory.SharedMemory(name=x[0])
+                for attr,x in self.blocks.items()]
+        self._shms = OrderedDict()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+def _attach_shared_memory(name,tracker):
+    if sys.version_info >= (3,13):
+        return shared_memory.SharedMemory(name=name,track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # before python 3.13, attaching registers the block to the resource tracker of this process,
+    # which unlinks it when the process exits though it is owned by the creating process. Forked
+    # and spawned processes inherit the tracker of the creating process, where the registration is
+    # kept for the unlink() of the creating process, so the block is only unregistered from a
+    # tracker of its own.
+    if tracker is None or _resource_tracker_id() != tracker:
+        resource_tracker.unregister(shm._name,'shared_memory')
+    return shm
+
+def _resource_tracker_id():
+    # the pipe to the resource tracker, which is inherited by forked and spawned processes,
+    # identifies the tracker. None if this process has not started or inherited one.
+    fd = getattr(resource_tracker._resource_tracker,'_fd',None)
+    if fd is None:
+        return None
+    try:
+        stat = os.fstat(fd)
+    except OSError:
+        return None
+    return (stat.st_dev,stat.st_ino)
+
+def _aligned(n,alignment=64):
+    return (n + alignment - 1) // alignment * alignment
+
+_DATASET_CACHE = OrderedDict()
+_DATASET_CACHE_LIMIT = {'max_entries':4,'max_bytes':None}
+_DATASET_CACHE_LOCK = threading.Lock()
+
+def set_dataset_cache_limit(max_entries=4,max_bytes=None):
+    '''
+    Set the size of the cache used by DataSet.load_dataset(cache=True). The least recently used
+    DataSets are evicted when the cache is over any limit.
+
+    Args:
+        max_entries: The max number of cached DataSets, None for no limit.
+        max_bytes: The max bytes of arrays held in memory by cached DataSets, None for no limit.
+            Arrays mapped from .npy files are not counted.
+    Return:
+        None
+    '''
+    with _DATASET_CACHE_LOCK:
+        _DATASET_CACHE_LIMIT['max_entries'] = max_entries
+        _DATASET_CACHE_LIMIT['max_bytes'] = max_bytes
+        _evict_dataset_cache()
+
+def clear_dataset_cache(name=None):
+    '''
+    Remove DataSets from the cache of DataSet.load_dataset(cache=True).
+
+    Args:
+        name: Only the DataSets of this name are removed if given, otherwise all of them.
+    Return:
+        None
+    '''
+    with _DATASET_CACHE_LOCK:
+        for key in list(_DATASET_CACHE.keys()):
+            if name is None or key[0] == name:
+                del _DATASET_CACHE[key]
+
+def _load_cached(name,save_path,condition):
+    _, file_name = _find_storage(name,save_path)
+    location = (name,os.path.abspath(save_path))
+    key = location + (os.path.getmtime(file_name),repr(sorted(condition.items(),key=str)))
+    with _DATASET_CACHE_LOCK:
+        if key in _DATASET_CACHE:
+            _DATASET_CACHE.move_to_end(key)
+            load_class = _DATASET_CACHE[key][0]
+            print('dataset ', name, ' has been load from cache')
+            return DataSet._from_columns(load_class.name,list(load_class.index),load_class.save_path,
+                                         _read_only_columns(load_class._columns))
+    load_class = DataSet._load(name,save_path,condition)
+    load_class._set_columns(_read_only_columns(load_class._columns),len(load_class))
+    print('dataset ', name, ' has been load')
+    with _DATASET_CACHE_LOCK:
+        # the saved files have changed, so older entries of this DataSet are stale
+        for k in list(_DATASET_CACHE.keys()):
+            if k[:2] == location and k[2] != key[2]:
+                del _DATASET_CACHE[k]
+        _DATASET_CACHE[key] = (load_class,_dataset_nbytes(load_class))
+        _evict_dataset_cache()
+    return DataSet._from_columns(load_class.name,list(load_class.index),load_class.save_path,
+                                 _read_only_columns(load_class._columns))
+
+def _evict_dataset_cache():
+    max_entries = _DATASET_CACHE_LIMIT['max_entries']
+    max_bytes = _DATASET_CACHE_LIMIT['max_bytes']
+    while len(_DATASET_CACHE) > 0:
+        if max_entries is not None and len(_DATASET_CACHE) > max_entries:
+            _DATASET_CACHE.popitem(last=False)
+        elif max_bytes is not None and sum(x[1] for x in _DATASET_CACHE.values()) > max_bytes:
+            _DATASET_CACHE.popitem(last=False)
+        else:
+            break
+
+def _read_only_columns(columns):
+    '''
+    New columns holding read-only views of the arrays in columns. The columns can be changed
+    (appended, shuffled...) without affecting each other, but the arrays are shared.
+    '''
+    r_columns = []
+    for column in columns:
+        values = column.values().copy()
+        if values.dtype.hasobject:
+            for i,x in enumerate(values):
+                if isinstance(x,np.ndarray):
+                    x = x.view()
+                    x.flags.writeable = False
+                    values[i] = x
+        r_columns.append(_Column.from_array(values))
+    return r_columns
+
+def _dataset_nbytes(dataset):
+    r_nbytes = 0
+    for column in dataset._columns:
+        values = column.values()
+        r_nbytes += values.nbytes
+        if values.dtype.hasobject:
+            r_nbytes += sum(x.nbytes for x in values
+                            if isinstance(x,np.ndarray) and not isinstance(x,np.memmap))
+    return r_nbytes
+
+def _array_moments(x,chunk_size,axis=None):
+    '''
+    Count, mean, sum of squared deviations, max and min of x, accumulated over chunks of the first
+    axis. The moments of chunks are merged as Chan et al., so the variance is computed in one pass
+    without cancellation.
+
+    Args:
+        x: numpy.ndarray.
+        chunk_size: The length of the chunks of the first axis.
+        axis: The axes reduced within a chunk. None reduces the whole array, otherwise the first
+            axis is kept and each chunk gives its own moments.
+    Return:
+        A tuple (count,mean,m2,max,min).
+    '''
+    if axis is not None:
+        x = np.asarray(x,dtype=np.float64)
+        mean = x.mean(axis=axis)
+        r_mean = mean.reshape((-1,)+(1,)*(x.ndim-1))
+        m2 = np.square(x - r_mean).sum(axis=axis)
+        return (x[0].size,mean,m2,x.max(axis=axis),x.min(axis=axis))
+    moments = None
+    for start in range(0,len(x),chunk_size):
+        x_chunk = np.asarray(x[start:start+chunk_size],dtype=np.float64)
+        mean = x_chunk.mean()
+        m2 = np.square(x_chunk - mean).sum()
+        moments = _merge_moments(moments,(x_chunk.size,mean,m2,x_chunk.max(),x_chunk.min()))
+    return moments
+
+def _merge_moments(a,b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    n = a[0] + b[0]
+    delta = b[1] - a[1]
+    mean = a[1] + delta*b[0]/n
+    m2 = a[2] + b[2] + delta*delta*a[0]*b[0]/n
+    return (n,mean,m2,np.maximum(a[3],b[3]),np.minimum(a[4],b[4]))
+
+def _moment_stats(moments,select):
+    '''
+    The shift and scale of normalization from moments given by _array_moments.
+    '''
+    n,mean,m2,x_max,x_min = moments
+    if select == 'fft':
+        return np.zeros_like(mean),x_max
+    elif select == 'min-max':
+        return mean,np.maximum(x_max - mean,mean - x_min)
+    return mean,np.sqrt(m2/n)
+
+class _Column(object):
+    '''
+    Values of one attribute in DataSet. Numbers, bools and strings are packed into a typed numpy
+    array, and other values (such as signals) are kept in an object array. The array grows by
+    doubling when appended, and is promoted to a wider type (or object) when a value does not fit.
+    '''
+    def __init__(self,values=()):
+        values = list(values)
+        self._data = np.empty(len(values),dtype=_values_dtype(values))
+        self._len = 0
+        for x in values:
+            self._data[self._len] = x
+            self._len += 1
+
+    @staticmethod
+    def from_array(array):
+        r_column = _Column()
+        r_column._data = array
+        r_column._len = len(array)
+        return r_column
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self,i):
+        x = self._data[self._position(i)]
+        return x if self._data.dtype.hasobject else x.item()
+
+    def __setitem__(self,i,x):
+        i = self._position(i)
+        self._promote(_value_dtype(x))
+        self._data[i] = x
+
+    def _position(self,i):
+        if i < 0:
+            i += self._len
+        if i < 0 or i >= self._len:
+            raise IndexError('column index out of range')
+        return i
+
+    def _promote(self,dtype):
+        if self._len == 0:
+            self._data = np.empty(len(self._data),dtype=dtype)
+        else:
+            dtype = _promote_dtype(self._data.dtype,dtype)
+            if dtype != self._data.dtype:
+                self._data = self._data.astype(dtype)
+
+    def append(self,x):
+        self._promote(_value_dtype(x))
+        if self._len == len(self._data):
+            data = np.empty(max(4,2*self._len),dtype=self._data.dtype)
+            data[:self._len] = self._data[:self._len]
+            self._data = data
+        self._data[self._len] = x
+        self._len += 1
+
+    def values(self):
+        return self._data[:self._len]
+
+    def tolist(self):
+        if self._data.dtype.hasobject:
+            return list(self.values())
+        return self.values().tolist()
+
+    def take(self,rows):
+        return _Column.from_array(self.values()[np.asarray(rows,dtype=int)])
+
+def _value_dtype(x):
+    if isinstance(x,(bool,np.bool_)):
+        return np.dtype(bool)
+    elif isinstance(x,(int,np.integer)):
+        return np.dtype(np.int64)
+    elif isinstance(x,(float,np.floating)):
+        return np.dtype(np.float64)
+    elif isinstance(x,str):
+        return np.dtype('U%d' % max(len(x),1))
+    return np.dtype(object)
+
+def _promote_dtype(a,b):
+    if a == b:
+        return a
+    elif a.kind == 'U' and b.kind == 'U':
+        return a if a.itemsize >= b.itemsize else b
+    # mixed ints and floats are kept as they are, e.g. RUL of PHM2012 data
+    return np.dtype(object)
+
+def _values_dtype(values):
+    if len(values) == 0:
+        return np.dtype(np.float64)
+    dtype = _value_dtype(values[0])
+    for x in values[1:]:
+        dtype = _promote_dtype(dtype,_value_dtype(x))
+    return dtype
+
+class _Rows(Sequence):
+    '''
+    Samples of a DataSet, which are views of its columns.
+    '''
+    def __init__(self,dataset):
+        self._dataset = dataset
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('dataset index out of range')
+        return _Row(self._dataset,i)
+
+    def append(self,sample):
+        self._dataset.append(list(sample))
+
+    def __repr__(self):
+        return repr([list(x) for x in self])
+
+class _Row(Sequence):
+    '''
+    A sample of a DataSet, whose values can be read and set as a list.
+    '''
+    def __init__(self,dataset,i):
+        self._dataset = dataset
+        self._i = i
+
+    def __len__(self):
+        return len(self._dataset.index)
+
+    def __getitem__(self,j):
+        if isinstance(j,slice):
+            return [self[k] for k in range(*j.indices(len(self)))]
+        return self._dataset._columns[j][self._i]
+
+    def __setitem__(self,j,x):
+        if j < 0:
+            j += len(self)
+        self._dataset._set_value(self._i,j,x)
+
+    def __repr__(self):
+        return repr(list(self))
+
+def _storage_dir(save_path,name):
+    return save_path + 'DataSet_' + name + '/'
+
+def _shard_name(i):
+    return 'shard_%05d' % i
+
+def _find_storage(name,save_path):
+    '''
+    Find how a DataSet is saved.
+
+    Return:
+        A tuple (storage, file name), where storage is 'dir' or 'pickle' and file name is the
+        manifest or the .pkl file.
+    '''
+    manifest_name = _storage_dir(save_path,name) + 'manifest.pkl'
+    pickle_name = save_path + 'DataSet_' + name + '.pkl'
+    if os.path.exists(manifest_name) and os.path.exists(pickle_name):
+        if os.path.getmtime(manifest_name) >= os.path.getmtime(pickle_name):
+            return 'dir', manifest_name
+        return 'pickle', pickle_name
+    elif os.path.exists(manifest_name):
+        return 'dir', manifest_name
+    elif os.path.exists(pickle_name):
+        return 'pickle', pickle_name
+    raise FileNotFoundError('DataSet ' + name + ' is not found in ' + save_path)
+
+def _read_manifest(dir_name):
+    with open(dir_name + 'manifest.pkl', 'rb') as f:
+        manifest = pickle.load(f)
+    manifest.setdefault('storage','npy')
+    manifest.setdefault('shards',OrderedDict())
+    return manifest
+
+def _write_manifest(dir_name,manifest):
+    with open(dir_name + 'manifest.pkl.tmp', 'wb') as f:
+        pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(dir_name + 'manifest.pkl.tmp', dir_name + 'manifest.pkl')
+
+def _clean_storage_dir(dir_name,keep):
+    '''
+    Remove blocks and shards which are no longer referred by the manifest.
+    '''
+    for x in os.listdir(dir_name):
+        if x in keep:
+            continue
+        if x.startswith('shard_') and os.path.isdir(dir_name + x):
+            shutil.rmtree(dir_name + x)
+        elif x.startswith('column_') and x.endswith('.npy'):
+            os.remove(dir_name + x)
+
+def _is_block_column(values):
+    '''
+    Whether a column can be saved as one .npy block.
+    '''
+    if not _is_shard_column(values):
+        return False
+    for x in values:
+        if x.ndim == 0 or x.dtype != values[0].dtype or x.shape[1:] != values[0].shape[1:]:
+            return False
+    return True
+
+def _is_shard_column(values):
+    '''
+    Whether a column can be saved as one .npy file per sample.
+    '''
+    if len(values) == 0:
+        return False
+    for x in values:
+        if not isinstance(x,np.ndarray) or x.dtype.hasobject:
+            return False
+    return True
+
+def _write_array(file_name,x):
+    '''
+    Write an array into a .npy file. Nothing is written if x is already the writable memmap of
+    this file. Otherwise the file is written aside and then replaced, because x may be
+    memory-mapped from the file which is being replaced.
+    '''
+    if isinstance(x,np.memmap) and isinstance(x.base,mmap.mmap) and x.mode == 'r+' \
+            and x.filename == os.path.abspath(file_name):
+        x.flush()
+        return
+    with open(file_name + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(x))
+    os.replace(file_name + '.tmp', file_name)
+
+def _write_block(file_name,values,offsets):
+    '''
+    Write arrays concatenated along the first axis into a .npy file without building the
+    concatenated array in memory. The file is written aside and then replaced, because the
+    values may be memory-mapped from the file which is being replaced.
+    '''
+    block = np.lib.format.open_memmap(file_name + '.tmp', mode='w+', dtype=values[0].dtype,
+                                      shape=(offsets[-1],) + values[0].shape[1:])
+    for i,x in enumerate(values):
+        block[offsets[i]:offsets[i+1]] = x
+    block.flush()
+    del block
+    os.replace(file_name + '.tmp', file_name)
+
+def _append_npy(file_name,data):
+    '''
+    Append arrays along the first axis of a .npy file in place. numpy leaves room in the header for
+    the first axis to grow, so normally only the header and the new data are written. Otherwise the
+    whole file is rewritten.
+    '''
+    with open(file_name, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1,0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            write_header = np.lib.format.write_array_header_1_0
+        elif version == (2,0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            write_header = np.lib.format.write_array_header_2_0
+        else:
+            write_header = None
+        if write_header is not None:
+            if fortran_order or dtype != data.dtype or shape[1:] != data.shape[1:]:
+                raise ValueError('data with shape ' + str(data.shape) + ' can not be appended to ' + file_name)
+            data_offset = f.tell()
+            header = io.BytesIO()
+            write_header(header, {'descr':np.lib.format.dtype_to_descr(dtype),'fortran_order':False,
+                                  'shape':(shape[0]+data.shape[0],)+shape[1:]})
+            if len(header.getvalue()) == data_offset:
+                # data is written before the header, the old header is still valid if it is interrupted
+                f.seek(data_offset + int(np.prod(shape))*dtype.itemsize)
+                f.write(np.ascontiguousarray(data).tobytes())
+                f.truncate()
+                f.flush()
+                f.seek(0)
+                f.write(header.getvalue())
+                return
+    _write_array(file_name, np.concatenate((np.load(file_name),data),axis=0))
+
+def _read_ingest_log(dir_name):
+    if not os.path.exists(dir_name + 'ingest_log.pkl'):
+        return OrderedDict()
+    with open(dir_name + 'ingest_log.pkl', 'rb') as f:
+        return pickle.load(f)
+
+def _write_ingest_log(dir_name,ingest_log):
+    with open(dir_name + 'ingest_log.pkl.tmp', 'wb') as f:
+        pickle.dump(ingest_log, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(dir_name + 'ingest_log.pkl.tmp', dir_name + 'ingest_log.pkl')
+
+PHM_RUL = {'Bearing1_1':0,'Bearing1_2':0,
+            'Bearing2_1':0,'Bearing2_2':0,
+            'Bearing3_1':0,'Bearing3_2':0,
+            'Bearing1_3':573,'Bearing1_4':33.9,'Bearing1_5':161,'Bearing1_6':146,'Bearing1_7':757,
+            'Bearing2_3':753,'Bearing2_4':139,'Bearing2_5':309,'Bearing2_6':129,'Bearing2_7':58,
+            'Bearing3_3':82}
+PHM_SNAPSHOT_LENGTH = 2560 # samples of a snapshot file, 0.1s at 25.6kHz
+
+def make_phm_dataset(source_path='./phm/',n_workers=None,save_path='./data/'):
+    '''
+    Make the DataSet of PHM2012 data.
+    The snapshot files of all bearings are read in a process pool, and the snapshots of each bearing
+    are filled into an array allocated once with the number of files. The files ingested are
+    recorded, so that new files can be appended later by update_phm_dataset().
+
+    Args:
+        source_path: The path contained 'Learning_set/' and 'Test_set/'.
+        n_workers: The number of processes reading files, defaulted as the number of CPUs.
+        save_path: The path where the DataSet is saved.
+    Return:
+        None
+    '''
     phm_dataset = DataSet(name='phm_data',
-                        index=['bearing_name','RUL','quantity','data'])
-    source_path = './phm/'
+                        index=['bearing_name','RUL','quantity','data'],
+                        save_path=save_path)
+    bearings_files = _list_phm_files(source_path)
+    bearings_data = _read_phm_bearings(bearings_files,n_workers)
+    for bearings_name,bearing_data in bearings_data.items():
+        phm_dataset.append([bearings_name,PHM_RUL[bearings_name],bearing_data.shape[0],bearing_data])
+        print(bearings_name,'has been appended.')
+
+    phm_dataset.save(storage='shard')
+    _write_ingest_log(_storage_dir(phm_dataset.save_path,phm_dataset.name),
+                      OrderedDict([(k,[os.path.basename(x) for x in v]) for k,v in bearings_files.items()]))
+
+def update_phm_dataset(source_path='./phm/',n_workers=None,save_path='./data/'):
+    '''
+    Append the snapshot files which are new since the last make_phm_dataset() or update_phm_dataset()
+    to the saved PHM DataSet. The files already ingested are recorded per bearing in
+    'ingest_log.pkl' of the DataSet directory, so only new files are read, and they are appended
+    to the end of the 'data' shard of their bearing on disk. A bearing not in the DataSet yet is
+    appended as a new sample. The DataSet should be saved with storage 'shard'.
+
+    Args:
+        source_path: The path contained 'Learning_set/' and 'Test_set/'.
+        n_workers: The number of processes reading files, defaulted as the number of CPUs.
+        save_path: The path where the DataSet is saved.
+    Return:
+        None
+    '''
+    dir_name = _storage_dir(save_path,'phm_data')
+    manifest = _read_manifest(dir_name)
+    if manifest['storage'] != 'shard':
+        raise ValueError('phm_data should be saved with storage \'shard\' to be updated!')
+    ingest_log = _read_ingest_log(dir_name)
+    bearings_files = _list_phm_files(source_path)
+    new_files = OrderedDict()
+    for k,v in bearings_files.items():
+        ingested = set(ingest_log.get(k,[]))
+        files = [x for x in v if os.path.basename(x) not in ingested]
+        if len(files) > 0:
+            new_files[k] = files
+    if len(new_files) == 0:
+        print('phm_data is up to date.')
+        return
+
+    names = manifest['columns']['bearing_name']
+    data_file = manifest['shards']['data']
+    for bearings_name,bearing_data in _read_phm_bearings(new_files,n_workers).items():
+        if bearings_name in names:
+            i = names.index(bearings_name)
+            _append_npy(dir_name + _shard_name(i) + '/' + data_file, bearing_data)
+            manifest['columns']['quantity'][i] += bearing_data.shape[0]
+        else:
+            i = manifest['quantity']
+            os.makedirs(dir_name + _shard_name(i), exist_ok=True)
+            _write_array(dir_name + _shard_name(i) + '/' + data_file, bearing_data)
+            manifest['columns']['bearing_name'].append(bearings_name)
+            manifest['columns']['RUL'].append(PHM_RUL.get(bearings_name))
+            manifest['columns']['quantity'].append(bearing_data.shape[0])
+            manifest['quantity'] += 1
+        ingest_log[bearings_name] = ingest_log.get(bearings_name,[]) + \
+                                    [os.path.basename(x) for x in new_files[bearings_name]]
+        print(bearings_name,'has been appended with',bearing_data.shape[0],'snapshots.')
+    _write_manifest(dir_name,manifest)
+    _write_ingest_log(dir_name,ingest_log)
+
+def _list_phm_files(source_path):
+    '''
+    Get the sorted snapshot files of each bearing in PHM2012 data.
+
+    Return:
+        An OrderedDict like {bearing_name:[file names]}.
+    '''
+    bearings_files = OrderedDict()
     for path_1 in ['Learning_set/','Test_set/']:
         bearings_names = os.listdir(source_path + path_1)
         bearings_names.sort()
         for bearings_name in bearings_names:
             file_names = os.listdir(source_path + path_1 + bearings_name + '/')
             file_names.sort()
-            bearing_data = np.array([])
-            for file_name in file_names:
-                if 'acc' in file_name:
-                    df = pd.read_csv(source_path + path_1 + bearings_name + '/'\
-                                    + file_name,header=None)
-                    data = np.array(df.loc[:,4:6])
-                    data = data[np.newaxis,:,:]
-                    if bearing_data.size == 0:
-                        bearing_data = data
-                    else:
-                        bearing_data = np.append(bearing_data,data,axis=0)
-        
-            phm_dataset.append([bearings_name,RUL_dict[bearings_name],bearing_data.shape[0],bearing_data])
-            print(bearings_name,'has been appended.')
-
-    phm_dataset.save()
-
-def make_paderborn_dataset():
-    paderborn_dataset = DataSet(
-        name='paderborn_data',
-        index=[
-            'bearing_name',
-            'load',
-            'speed',
-            'fault_place',
-            'fault_cause',
-            'state',
-            'No',
-            'data'
-        ]
-    )
-    source_path = 'C:/Users/ZHU/Desktop/phm-ieee-2012-data-challenge-dataset-master/Learning_set/Bearing2_1'
+            bearings_files[bearings_name] = [source_path + path_1 + bearings_name + '/' + x
+                                             for x in file_names if 'acc' in x]
+    return bearings_files
+
+def _read_phm_bearings(bearings_files,n_workers=None):
+    '''
+    Read snapshot files of bearings in a process pool. The snapshots of each bearing are filled into
+    an array allocated once with the number of files.
+
+    Args:
+        bearings_files: An OrderedDict like {bearing_name:[file names]}.
+        n_workers: The number of processes reading files, defaulted as the number of CPUs.
+    Return:
+        An OrderedDict like {bearing_name:array with shape (n_files, 2560, 2)}.
+    '''
+    tasks = [(k,i,x) for k in bearings_files.keys() for i,x in enumerate(bearings_files[k])]
+    bearings_data = OrderedDict([(k,None) for k in bearings_files.keys()])
+    with ProcessPoolExecutor(n_workers) as executor:
+        # all bearings are submitted together, results come back in order of tasks
+        for (bearings_name,i,_),data in zip(tasks,executor.map(_read_phm_csv,[x[2] for x in tasks],chunksize=64)):
+            if bearings_data[bearings_name] is None:
+                bearings_data[bearings_name] = np.empty((len(bearings_files[bearings_name]),)+data.shape,
+                                                        dtype=data.dtype)
+            bearings_data[bearings_name][i] = data
+            if i == len(bearings_files[bearings_name]) - 1:
+                print(bearings_name,'has been read.')
+    for bearings_name,bearing_data in bearings_data.items():
+        if bearing_data is None:
+            # a bearing directory without acc files, kept as a bearing of no snapshots
+            bearings_data[bearings_name] = np.empty((0,PHM_SNAPSHOT_LENGTH,2),dtype=np.float64)
+            print(bearings_name,'has no snapshot files.')
+    return bearings_data
+
+def _read_phm_csv(file_name):
+    '''
+    Read the horizontal and vertical acceleration (the 5th and 6th column) of a PHM snapshot file.
+    Some bearings use ';' instead of ',' as separator.
+    '''
+    with open(file_name) as f:
+        sep = ';' if ';' in f.readline() else ','
+    return pd.read_csv(file_name,header=None,sep=sep,usecols=[4,5],
+                       dtype=np.float64,engine='c').values
+
+def make_paderborn_dataset(source_path='./paderborn/',channels=None,n_workers=None,save_path='./data/'):
+    '''
+    Make the DataSet of Paderborn data, one sample per .mat file.
+    The .mat files are read in a process pool. Each worker only decodes the variable of the file
+    and returns the requested signals of 'Y', so the other signals never leave the worker. The
+    samples are filled into columns allocated once with the number of files.
+
+    Args:
+        source_path: The path contained the .mat files, which may be in sub-directories per bearing.
+        channels: An OrderedDict like {attribute:signal}, where signal is the position of the signal
+            in 'Y' or its name (such as 'vibration_1'). Defaulted as {'data':6}, the vibration signal.
+        n_workers: The number of processes reading files, defaulted as the number of CPUs.
+        save_path: The path where the DataSet is saved.
+    Return:
+        None
+    '''
+    if channels is None:
+        channels = OrderedDict([('data',6)])
+    index = ['bearing_name','load','speed','fault_place','fault_cause','state','No'] + list(channels.keys())
     artificial_fault = ['KI01','KI03','KI05','KI07','KI08',
                 'KA01','KA03','KA05','KA06','KA07']
     state = {
@@ -433,74 +1492,134 @@ def make_paderborn_dataset():
         'KB24':'Pitting',
         'KB27':'Plastic Deform'
     }
-    file_names = os.listdir(source_path)
-    file_names.sort()
-    for file_name in file_names:
-        temp_data = sio.loadmat(source_path + file_name)
-        temp_data = temp_data[file_name.replace('.mat','')]
-        temp_data = temp_data['Y']
-        temp_data = temp_data[0][0][0][6][2][0]
-        temp_fault_cause = 'artificial' if file_name[12:16] in artificial_fault \
-                                        else 'real'
-        temp_append_sample = [
-            file_name,
-            file_name[4:11],
-            file_name[0:3],
-            file_name[12:16],
-            temp_fault_cause,
-            state[file_name[12:16]],
-            file_name[17:],
-            temp_data
-        ]
-        paderborn_dataset.append(temp_append_sample)
-        print(file_name,'has been appended.')
-
-    paderborn_dataset.save()
-
-def make_ims_dataset():
+    file_names = []
+    for root, _, names in os.walk(source_path):
+        file_names += [os.path.join(root,x) for x in names if x.endswith('.mat')]
+    file_names.sort(key=os.path.basename)
+    columns = [[None]*len(file_names) for _ in index]
+    with ProcessPoolExecutor(n_workers) as executor:
+        tasks = [(x,list(channels.values())) for x in file_names]
+        for i,temp_data in enumerate(executor.map(_read_paderborn_mat,tasks)):
+            file_name = os.path.basename(file_names[i])
+            temp_fault_cause = 'artificial' if file_name[12:16] in artificial_fault \
+                                            else 'real'
+            temp_append_sample = [
+                file_name,
+                file_name[4:11],
+                file_name[0:3],
+                file_name[12:16],
+                temp_fault_cause,
+                state[file_name[12:16]],
+                file_name[17:]
+            ] + temp_data
+            for j,x in enumerate(temp_append_sample):
+                columns[j][i] = x
+            print(file_name,'has been appended.')
+
+    paderborn_dataset = DataSet._from_columns('paderborn_data',index,save_path,columns)
+    paderborn_dataset.save(storage='shard')
+
+def _read_paderborn_mat(task):
+    '''
+    Read signals of a Paderborn .mat file. Only the variable named as the file is decoded by loadmat.
+
+    Args:
+        task: A tuple (file name, signals), where each signal is its position in 'Y' or its name.
+    Return:
+        A list of 1-D arrays of the signals.
+    '''
+    file_name, signals = task
+    var_name = os.path.basename(file_name).replace('.mat','')
+    temp_data = sio.loadmat(file_name, variable_names=[var_name])[var_name]
+    temp_data = temp_data['Y'][0][0][0]
+    r_data = []
+    for signal in signals:
+        if not isinstance(signal,int):
+            names = [str(x[0][0]) for x in temp_data]
+            signal = names.index(signal)
+        r_data.append(temp_data[signal][2][0])
+    return r_data
+
+def make_ims_dataset(source_path='E:/cyh/data_sum/temp/IMS data/',n_workers=None,save_path='./data/',chunk_size=32):
+    '''
+    Make the DataSet of IMS data, one sample per faulty bearing channel.
+    The 'data' shard of each sample is allocated on disk first, then the record files are parsed in
+    a process pool, and each worker writes the selected channels of its records directly into the
+    shards. So the records are never gathered in memory.
+
+    Args:
+        source_path: The path contained '1st_test/', '2nd_test/' and '4th_test/'.
+        n_workers: The number of processes parsing files, defaulted as the number of CPUs.
+        save_path: The path where the DataSet is saved.
+        chunk_size: The number of files parsed by a worker at a time.
+    Return:
+        None
+    '''
     fault_bearing = {'1st_test':OrderedDict({4:'3_x',5:'3_y',6:'4_x',7:'4_y'}), '2nd_test':[0], '4th_test':[2]}
-    ims_dataset = DataSet(name='ims_data', index=['set_No','bearing_No','record_time','data'])
-    source_path = 'E:/cyh/data_sum/temp/IMS data/'
-
-    for dir_name in fault_bearing.keys():
-        # if isinstance(fault_bearing[dir_name],dict):
-        #     all_samples = []
-        #     for k in fault_bearing[dir_name].keys():
-        #         all_samples.append([dir_name, fault_bearing[dir_name][k], [], []])
-        if isinstance(fault_bearing[dir_name], dict):
-            channels = list(fault_bearing[dir_name].keys())
-        elif isinstance(fault_bearing[dir_name], list):
-            channels = fault_bearing[dir_name]
-        record_time = []
-        record_data = np.array([])
-
-        names = os.listdir(source_path + dir_name + '/')
-        names.sort()
-        for name in names:
-            print(name)
-            record_time.append(name.replace('.txt',''))
-            temp_data = np.loadtxt(source_path + dir_name + '/' + name)
-            if record_data.size == 0:
-                record_data = temp_data[:,channels][np.newaxis,:,:]
-            else:
-                record_data = np.append(record_data, temp_data[:,channels][np.newaxis,:,:], axis=0)
-        
-        if isinstance(fault_bearing[dir_name], dict):
-            append_samples = []
-            for i,k in enumerate(fault_bearing[dir_name].keys()):
-                append_samples.append([dir_name, fault_bearing[dir_name][k], record_time, record_data[:,:,i]])
-        elif isinstance(fault_bearing[dir_name], list):
-            append_samples = []
-            for i,x in enumerate(fault_bearing[dir_name]):
-                append_samples.append([dir_name, str(x), record_time, record_data[:,:,i]])
+    ims_dataset = DataSet(name='ims_data', index=['set_No','bearing_No','record_time','data'], save_path=save_path)
+    dir_name = _storage_dir(save_path,ims_dataset.name)
+    data_file = 'column_%d.npy' % ims_dataset.index.index('data')
 
-        for sample in append_samples:
-            ims_dataset.append(sample)
+    with ProcessPoolExecutor(n_workers) as executor:
+        for test_name in fault_bearing.keys():
+            if isinstance(fault_bearing[test_name], dict):
+                channels = list(fault_bearing[test_name].keys())
+                bearings_No = list(fault_bearing[test_name].values())
+            elif isinstance(fault_bearing[test_name], list):
+                channels = fault_bearing[test_name]
+                bearings_No = [str(x) for x in fault_bearing[test_name]]
 
-    ims_dataset.save()
+            names = os.listdir(source_path + test_name + '/')
+            names.sort()
+            file_names = [source_path + test_name + '/' + x for x in names]
+            record_time = [x.replace('.txt','') for x in names]
+            n_samples = _read_ims_txt(file_names[0],channels).shape[0]
 
-            
+            out_files = []
+            for i in range(len(channels)):
+                out_files.append(dir_name + _shard_name(len(ims_dataset) + i) + '/' + data_file)
+                os.makedirs(os.path.dirname(out_files[-1]), exist_ok=True)
+                np.lib.format.open_memmap(out_files[-1], mode='w+', dtype=np.float64,
+                                          shape=(len(file_names),n_samples)).flush()
+            tasks = [(file_names[i:i+chunk_size],i,channels,out_files)
+                     for i in range(0,len(file_names),chunk_size)]
+            for n in executor.map(_ingest_ims_files,tasks):
+                print(test_name,n,'records have been ingested.')
 
+            for i in range(len(channels)):
+                ims_dataset.append([test_name, bearings_No[i], record_time,
+                                    np.load(out_files[i], mmap_mode='r+')])
+
+    # the shards have been written, so only the manifest is written here
+    ims_dataset.save(storage='shard')
+
+def _ingest_ims_files(task):
+    '''
+    Parse IMS record files and write the selected channels into the shards of the samples.
+
+    Args:
+        task: A tuple (file names, position of the first file, channels, shard file of each channel).
+    Return:
+        The last position written.
+    '''
+    file_names, start, channels, out_files = task
+    outs = [np.load(x, mmap_mode='r+') for x in out_files]
+    for i,file_name in enumerate(file_names):
+        data = _read_ims_txt(file_name,channels)
+        for j,out in enumerate(outs):
+            out[start + i] = data[:,j]
+    for out in outs:
+        out.flush()
+    return start + len(file_names)
+
+def _read_ims_txt(file_name,channels):
+    '''
+    Read the selected channels of an IMS record file, whose columns are separated by whitespace.
+    '''
+    data = pd.read_csv(file_name,header=None,sep=r'\s+',usecols=channels,
+                       dtype=np.float64,engine='c').values
+    # usecols does not keep the order of channels
+    return data[:,np.argsort(np.argsort(channels))]
 
 if __name__ == '__main__':
     make_phm_dataset()
@@ -104,9 +104,8 @@ class DQNAgent:
 
 
 if __name__ == "__main__":
-    env = RUL_Predict('phm_data')
-    env.dataset.dataset_filter({'bearing_name':['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']})
-    env.dataset.normalization('data')
+    env = RUL_Predict('phm_data',{'bearing_name':['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']})
+    env.dataset.normalization('data',dtype=np.float32)
     state_size = (2560,2)
     action_size = 11
     statement_size = 2000
@@ -4,8 +4,8 @@ import numpy as np
 from collections import deque
 
 class RUL_Predict():
-    def __init__(self,data_name):
-        self.dataset = DataSet.load_dataset(name=data_name)
+    def __init__(self,data_name,condition={},cache=False):
+        self.dataset = DataSet.load_dataset(name=data_name,condition=condition,cache=cache)
 
     def reset(self,stage):
         assert stage < 8
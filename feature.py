@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+"""
+Feature extraction of vibration signals, shared by the RUL models.
+"""
+
+import os
+import shutil
+import pickle
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+TIME_FEATURES = ['mean','rms','kur','skew','p2p','var','cre','imp','mar','sha','smr','cle']
+
+# the sums needed by each feature, so that only the passes of selected features are made
+_TIME_FEATURE_SUMS = {
+    'mean':[],
+    'rms':['m2'],
+    'kur':['m2','m4'],
+    'skew':['m2','m3'],
+    'p2p':['max'],
+    'var':['m2'],
+    'cre':['m2','abs_max'],
+    'imp':['abs_max','abs'],
+    'mar':['abs_max','sqrt'],
+    'sha':['m2','abs'],
+    'smr':['sqrt'],
+    'cle':['max','sqrt']
+}
+
+def time_features(data,features=None,chunk_size=256,dtype=np.float64):
+    '''
+    Time domain features of signals. All features are computed from the same central moments and
+    sums of |x| and sqrt(|x|), made in one pass over chunks of the first axis, so the temporaries are
+    never larger than a chunk.
+
+    Args:
+        data: numpy.ndarray with shape (samples, channels, length).
+        features: A list of features in TIME_FEATURES, defaulted as all of them.
+        chunk_size: The number of samples per chunk.
+        dtype: The dtype of returned features.
+    Return:
+        numpy.ndarray with shape (samples, channels*len(features)), features of the first channel
+        come first.
+    '''
+    if features is None:
+        features = TIME_FEATURES
+    for x in features:
+        if x not in _TIME_FEATURE_SUMS:
+            raise ValueError('feature ' + str(x) + ' should be one of ' + str(TIME_FEATURES))
+    sums = set(y for x in features for y in _TIME_FEATURE_SUMS[x])
+    r_fea = np.empty((data.shape[0],data.shape[1],len(features)),dtype=dtype)
+    for start in range(0,data.shape[0],chunk_size):
+        stats = _time_stats(data[start:start+chunk_size],sums)
+        for j,x in enumerate(features):
+            r_fea[start:start+chunk_size,:,j] = _time_feature(stats,x)
+    return r_fea.reshape(data.shape[0],data.shape[1]*len(features))
+
+def _time_stats(data,sums):
+    data = np.asarray(data,dtype=np.float64)
+    n = data.shape[2]
+    stats = OrderedDict()
+    stats['mean'] = data.mean(axis=2)
+    if sums & {'m2','m3','m4'}:
+        d = data - stats['mean'][:,:,np.newaxis]
+        d2 = d*d
+        stats['m2'] = d2.sum(axis=2) / n
+        if 'm3' in sums:
+            stats['m3'] = np.einsum('ijk,ijk->ij',d2,d) / n
+        if 'm4' in sums:
+            stats['m4'] = np.einsum('ijk,ijk->ij',d2,d2) / n
+        del d, d2
+    if 'max' in sums:
+        stats['max'] = data.max(axis=2)
+        stats['min'] = data.min(axis=2)
+    if sums & {'abs','abs_max','sqrt'}:
+        a = np.abs(data)
+        stats['abs_max'] = a.max(axis=2)
+        stats['abs'] = a.mean(axis=2)
+        if 'sqrt' in sums:
+            np.sqrt(a,out=a)
+            stats['sqrt'] = a.mean(axis=2)
+    return stats
+
+def _time_feature(stats,name):
+    if name == 'mean':
+        return stats['mean']
+    elif name == 'rms':
+        return np.sqrt(stats['m2'] + stats['mean']**2)
+    elif name == 'kur':
+        return stats['m4'] / stats['m2']**2
+    elif name == 'skew':
+        return stats['m3'] / stats['m2']**(3/2)
+    elif name == 'p2p':
+        return stats['max'] - stats['min']
+    elif name == 'var':
+        return stats['m2']
+    elif name == 'cre':
+        return stats['abs_max'] / _time_feature(stats,'rms')
+    elif name == 'imp':
+        return stats['abs_max'] / stats['abs']
+    elif name == 'mar':
+        return stats['abs_max'] / stats['sqrt']**2
+    elif name == 'sha':
+        return _time_feature(stats,'rms') / stats['abs']
+    elif name == 'smr':
+        return stats['sqrt']**2
+    elif name == 'cle':
+        return _time_feature(stats,'p2p') / stats['sqrt']**2
+    raise ValueError('feature ' + str(name) + ' should be one of ' + str(TIME_FEATURES))
+
+def half_spectrum(data,dtype=np.float32):
+    '''
+    The first half of the spectrum of signals, normalized by the length, as np.fft.fft(data)/n
+    [...,:n//2] but computed by a real FFT.
+
+    Args:
+        data: numpy.ndarray of signals in the last axis.
+        dtype: The real dtype of the computation, the spectrum is of the complex dtype of it.
+    Return:
+        numpy.ndarray with shape data.shape[:-1] + (n//2,).
+    '''
+    n = data.shape[-1]
+    spectrum = np.fft.rfft(np.asarray(data,dtype=dtype),axis=-1)[...,:n//2]
+    spectrum /= n
+    return spectrum
+
+def band_energy(data,n_bands=5,edges=None,fs=25600,chunk_size=256,dtype=np.float32):
+    '''
+    Energies of frequency bands of signals, which are sums of |fft(x)/n|**2 over the bins of each
+    band. The spectrum is computed by a real FFT in chunks of the first axis, and the bins are
+    summed by one reduceat. The default bands split [0,fs/2) into 5 equal bands, which for PHM data
+    (2560 points, 25.6 kHz) are the 5 bands of 256 bins used before.
+
+    Args:
+        data: numpy.ndarray with shape (samples, channels, length).
+        n_bands: The number of equal bands, used if edges is None.
+        edges: Increasing band edges in Hz, the i-th band is [edges[i],edges[i+1]).
+        fs: The sampling rate in Hz.
+        chunk_size: The number of samples per chunk.
+        dtype: The dtype of the computation and the returned features.
+    Return:
+        C-contiguous numpy.ndarray with shape (samples, channels*bands), bands of the first channel
+        come first.
+    '''
+    n = data.shape[2]
+    if edges is None:
+        edges = np.linspace(0,fs/2,n_bands+1)
+    bins = np.round(np.asarray(edges,dtype=np.float64)*n/fs).astype(int)
+    if len(bins) < 2 or np.any(np.diff(bins) <= 0) or bins[0] < 0 or bins[-1] > n//2 + 1:
+        raise ValueError('edges should be increasing in [0,fs/2] and wider than a bin!')
+    r_fea = np.empty((data.shape[0],data.shape[1],len(bins)-1),dtype=dtype)
+    for start in range(0,data.shape[0],chunk_size):
+        spectrum = np.fft.rfft(np.asarray(data[start:start+chunk_size],dtype=dtype),axis=2)
+        power = np.square(spectrum.real[:,:,bins[0]:bins[-1]])
+        power += np.square(spectrum.imag[:,:,bins[0]:bins[-1]])
+        power /= n*n
+        r_fea[start:start+chunk_size] = np.add.reduceat(power,bins[:-1]-bins[0],axis=2)
+    return r_fea.reshape(data.shape[0],data.shape[1]*(len(bins)-1))
+
+def envelope_energy(data,frequencies,harmonics=3,bandwidth=5.,fs=25600,chunk_size=256,dtype=np.float32):
+    '''
+    Energies of the envelope spectrum around characteristic frequencies (such as the fault
+    frequencies of the outer race, inner race, ball and cage). The envelope is the magnitude of the
+    analytic signal given by the Hilbert transform in frequency domain, and the energy of a frequency
+    is the sum of |fft(envelope)/n|**2 within +-bandwidth of its harmonics.
+
+    Args:
+        data: numpy.ndarray with shape (samples, channels, length).
+        frequencies: A list of characteristic frequencies in Hz.
+        harmonics: The number of harmonics of every frequency.
+        bandwidth: The half width of the band around every harmonic in Hz.
+        fs: The sampling rate in Hz.
+        chunk_size: The number of samples per chunk.
+        dtype: The dtype of the computation and the returned features.
+    Return:
+        C-contiguous numpy.ndarray with shape (samples, channels*len(frequencies)), energies of the
+        first channel come first.
+    '''
+    n = data.shape[2]
+    bands = _harmonic_bands(frequencies,harmonics,bandwidth,fs,n).astype(dtype)
+    # the Hilbert transform keeps the DC (and Nyquist) bin and doubles the positive frequencies
+    h = np.full(n//2+1,2,dtype=dtype)
+    h[0] = 1
+    if n % 2 == 0:
+        h[-1] = 1
+    r_fea = np.empty((data.shape[0],data.shape[1],bands.shape[1]),dtype=dtype)
+    for start in range(0,data.shape[0],chunk_size):
+        spectrum = np.fft.rfft(np.asarray(data[start:start+chunk_size],dtype=dtype),axis=2)
+        spectrum *= h
+        envelope = np.abs(np.fft.ifft(spectrum,n=n,axis=2))
+        envelope -= envelope.mean(axis=2,keepdims=True)
+        spectrum = np.fft.rfft(envelope,axis=2)
+        power = np.square(spectrum.real)
+        power += np.square(spectrum.imag)
+        power /= n*n
+        r_fea[start:start+chunk_size] = power @ bands
+    return r_fea.reshape(data.shape[0],data.shape[1]*bands.shape[1])
+
+def _harmonic_bands(frequencies,harmonics,bandwidth,fs,n):
+    '''
+    A 0/1 matrix with shape (n//2+1, len(frequencies)) selecting the bins of the bands around the
+    harmonics of every frequency.
+    '''
+    if frequencies is None or len(frequencies) == 0:
+        raise ValueError('frequencies should be given for envelope features!')
+    bin_frequencies = np.arange(n//2+1) * fs / n
+    r_bands = np.zeros((n//2+1,len(frequencies)))
+    for j,f in enumerate(frequencies):
+        for k in range(1,harmonics+1):
+            r_bands[np.abs(bin_frequencies - k*f) <= bandwidth, j] = 1
+    return r_bands
+
+def wavelet_packet_energy(data,level=3,chunk_size=256,dtype=np.float32):
+    '''
+    Energies of the nodes of a Haar wavelet packet decomposition. Every level splits all nodes into
+    the sums and differences of neighbouring points at once, so all nodes of a level are computed by
+    one reshape. The energy of a node is its sum of squares divided by the length, so the energies
+    of a signal sum up to its mean square.
+
+    Args:
+        data: numpy.ndarray with shape (samples, channels, length), where length should be divisible
+            by 2**level.
+        level: The level of decomposition, which gives 2**level nodes.
+        chunk_size: The number of samples per chunk.
+        dtype: The dtype of the computation and the returned features.
+    Return:
+        C-contiguous numpy.ndarray with shape (samples, channels*2**level), nodes are in the order
+        of frequency and nodes of the first channel come first.
+    '''
+    n = data.shape[2]
+    if level < 1 or n % 2**level != 0:
+        raise ValueError('length of signals should be divisible by 2**level!')
+    # the detail of Haar filters mirrors the spectrum, so the nodes are in the gray code order
+    order = np.array([i ^ (i >> 1) for i in range(2**level)])
+    r_fea = np.empty((data.shape[0],data.shape[1],2**level),dtype=dtype)
+    for start in range(0,data.shape[0],chunk_size):
+        nodes = np.asarray(data[start:start+chunk_size],dtype=dtype)[:,:,np.newaxis,:]
+        for _ in range(level):
+            pairs = nodes.reshape(nodes.shape[:3] + (nodes.shape[3]//2,2))
+            nodes = np.stack((pairs[...,0] + pairs[...,1],pairs[...,0] - pairs[...,1]),axis=3)
+            nodes = nodes.reshape(nodes.shape[:2] + (-1,nodes.shape[4])) / np.sqrt(2).astype(dtype)
+        r_fea[start:start+chunk_size] = np.einsum('ijkl,ijkl->ijk',nodes,nodes)[:,:,order] / n
+    return r_fea.reshape(data.shape[0],data.shape[1]*2**level)
+
+def extract_features(data,extractors,n_workers=None,chunk_size=512):
+    '''
+    Extract features of several arrays (such as bearings) in a process pool. Every array is split
+    into chunks of its first axis, which are extracted independently and written into the outputs
+    allocated once per array, so the long bearings are spread over the workers as well.
+
+    Args:
+        data: A list of numpy.ndarray with shape (samples, channels, length).
+        extractors: A list of (name, kwargs), where name is a key of FEATURE_EXTRACTORS and kwargs
+            are passed to the function, such as ('fre',{'fs':25600}).
+        n_workers: The number of processes, defaulted as the number of CPUs. The features are
+            extracted in this process if it is 1.
+        chunk_size: The number of samples per task.
+    Return:
+        A list per array of lists per extractor of numpy.ndarray with shape (samples, features).
+    '''
+    for name,_ in extractors:
+        if name not in FEATURE_EXTRACTORS:
+            raise ValueError('extractor ' + str(name) + ' should be one of ' + str(list(FEATURE_EXTRACTORS.keys())))
+    r_fea = [[None]*len(extractors) for _ in data]
+    tasks = ((i,start,x[start:start+chunk_size],extractors)
+             for i,x in enumerate(data) for start in range(0,len(x),chunk_size))
+
+    def _fill(i,start,fea):
+        for j,x in enumerate(fea):
+            if r_fea[i][j] is None:
+                r_fea[i][j] = np.empty((len(data[i]),) + x.shape[1:],dtype=x.dtype)
+            r_fea[i][j][start:start+len(x)] = x
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if n_workers <= 1:
+        for task in tasks:
+            _fill(*_extract_chunk(task))
+    else:
+        with ProcessPoolExecutor(n_workers) as executor:
+            # a few tasks per worker are in flight, so the chunks are not all copied to the queue
+            running = set()
+            for task in tasks:
+                running.add(executor.submit(_extract_chunk,task))
+                if len(running) >= 2*n_workers:
+                    done, running = wait(running,return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _fill(*future.result())
+            for future in running:
+                _fill(*future.result())
+    for i,x in enumerate(data):
+        if len(x) == 0:
+            r_fea[i] = [FEATURE_EXTRACTORS[name](x,**kwargs) for name,kwargs in extractors]
+    return r_fea
+
+def _extract_chunk(task):
+    i, start, data, extractors = task
+    return i, start, [FEATURE_EXTRACTORS[name](data,**kwargs) for name,kwargs in extractors]
+
+FEATURE_EXTRACTORS = OrderedDict([('time',time_features),('fre',band_energy),('env',envelope_energy),
+                                  ('wpt',wavelet_packet_energy)])
+
+class StreamingFeatureExtractor(object):
+    '''
+    Extract features of snapshots as they come, such as one new snapshot of a bearing every 10 s.
+    The features of each snapshot are the same as extract_features() and the _preprocess of the
+    models give, and the cost of a snapshot does not depend on how many were seen before.
+    '''
+    def __init__(self,extractors,normalize='snapshot',range_type='min-max'):
+        '''
+        Args:
+            extractors: A list of (name, kwargs) as extract_features().
+            normalize: 'snapshot' scales features of every extractor into [0,1] per snapshot, as
+                _normalize(fea,dim=1) of the models. 'running' scales each feature by its min and
+                max over all snapshots seen so far, which are updated with every snapshot. A fitted
+                Scaler scales features by the statistics of the training features. None returns
+                features as they are.
+            range_type: 'min-max' (attention2, best_attention) or 'decade' (attention, the range is
+                rounded up to a power of 10).
+        '''
+        if normalize not in ['snapshot','running',None] and not isinstance(normalize,Scaler):
+            raise ValueError('normalize should be \'snapshot\', \'running\', a Scaler or None!')
+        if range_type not in ['min-max','decade']:
+            raise ValueError('range_type should be \'min-max\' or \'decade\'!')
+        for name,_ in extractors:
+            if name not in FEATURE_EXTRACTORS:
+                raise ValueError('extractor ' + str(name) + ' should be one of ' + str(list(FEATURE_EXTRACTORS.keys())))
+        self.extractors = extractors
+        self.normalize = normalize
+        self.range_type = range_type
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.fea_min = None
+        self.fea_max = None
+
+    def update(self,snapshots):
+        '''
+        Extract features of new snapshots.
+
+        Args:
+            snapshots: numpy.ndarray with shape (length, channels) for one snapshot, or
+                (snapshots, length, channels) for a batch, as stored in DataSet.
+        Return:
+            numpy.ndarray with shape (snapshots, 1, features), as the features given by _preprocess.
+        '''
+        snapshots = np.asarray(snapshots)
+        if snapshots.ndim == 2:
+            snapshots = snapshots[np.newaxis]
+        data = snapshots.transpose(0,2,1)
+        r_fea = []
+        for name,kwargs in self.extractors:
+            fea = FEATURE_EXTRACTORS[name](data,**kwargs)
+            if self.normalize == 'snapshot':
+                fea = _range_normalize(fea,fea.min(axis=1,keepdims=True),fea.max(axis=1,keepdims=True),
+                                       self.range_type)
+            r_fea.append(fea)
+        r_fea = np.concatenate(r_fea,axis=1) if len(r_fea) > 1 else r_fea[0]
+        if self.normalize == 'running':
+            if self.count == 0:
+                self.fea_min, self.fea_max = r_fea.min(axis=0), r_fea.max(axis=0)
+            else:
+                np.minimum(self.fea_min,r_fea.min(axis=0),out=self.fea_min)
+                np.maximum(self.fea_max,r_fea.max(axis=0),out=self.fea_max)
+            r_fea = _range_normalize(r_fea,self.fea_min,self.fea_max,self.range_type)
+        elif isinstance(self.normalize,Scaler):
+            r_fea = self.normalize.transform(r_fea)
+        self.count += len(r_fea)
+        return r_fea[:,np.newaxis,:]
+
+def _range_normalize(fea,fea_min,fea_max,range_type):
+    # a feature without range (the first snapshot seen, or a constant feature) is scaled to 0
+    fea_range = fea_max - fea_min
+    with np.errstate(divide='ignore',invalid='ignore'):
+        if range_type == 'decade':
+            fea_range = 10.**np.ceil(np.log10(fea_range))
+        return np.where(fea_range > 0,(fea - fea_min) / fea_range,0.)
+
+class Scaler(object):
+    '''
+    Scale features by statistics of each feature fitted once on the training features, so the test
+    features and new snapshots are scaled as the training ones without scanning them first.
+    '''
+    def __init__(self,method='min-max',config=None):
+        '''
+        Args:
+            method: 'min-max' (x-min)/(max-min), 'decade' (x-min)/10**ceil(log10(max-min)) or
+                'z-score' (x-mean)/std.
+            config: A key of the configuration of the features, checked by training_scaler.
+        '''
+        if method not in ['min-max','decade','z-score']:
+            raise ValueError('method should be \'min-max\', \'decade\' or \'z-score\'!')
+        self.method = method
+        self.config = config
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.fea_min = None
+        self.fea_max = None
+
+    def partial_fit(self,fea):
+        '''
+        Update the statistics with features, whose last axis is the features.
+        '''
+        fea = np.asarray(fea,dtype=np.float64)
+        fea = fea.reshape(-1,fea.shape[-1])
+        if len(fea) == 0:
+            return self
+        n, mean = len(fea), fea.mean(axis=0)
+        m2 = np.square(fea - mean).sum(axis=0)
+        if self.count == 0:
+            self.mean, self.m2 = mean, m2
+            self.fea_min, self.fea_max = fea.min(axis=0), fea.max(axis=0)
+        else:
+            total = self.count + n
+            delta = mean - self.mean
+            self.mean = self.mean + delta*n/total
+            self.m2 = self.m2 + m2 + delta*delta*self.count*n/total
+            self.fea_min = np.minimum(self.fea_min,fea.min(axis=0))
+            self.fea_max = np.maximum(self.fea_max,fea.max(axis=0))
+        self.count += n
+        return self
+
+    def fit(self,fea):
+        '''
+        Fit the statistics in one pass.
+
+        Args:
+            fea: numpy.ndarray whose last axis is the features, or a list of them (such as bearings).
+        Return:
+            self
+        '''
+        self.reset()
+        for x in (fea if isinstance(fea,list) else [fea]):
+            self.partial_fit(x)
+        return self
+
+    def transform(self,fea):
+        if self.count == 0:
+            raise ValueError('Scaler should be fitted before transform!')
+        if np.shape(fea)[-1] != len(self.mean):
+            raise ValueError('Scaler is fitted with ' + str(len(self.mean)) + ' features, but got '
+                             + str(np.shape(fea)[-1]))
+        if self.method == 'z-score':
+            return (fea - self.mean) / np.sqrt(self.m2/self.count)
+        return _range_normalize(fea,self.fea_min,self.fea_max,
+                                'decade' if self.method == 'decade' else 'min-max')
+
+    def save(self,file_name):
+        os.makedirs(os.path.dirname(file_name) or '.',exist_ok=True)
+        with open(file_name,'wb') as f:
+            pickle.dump(self,f,pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name,'rb') as f:
+            return pickle.load(f)
+
+def training_scaler(method,path,name,config,fea=None,fit=None):
+    '''
+    Get the Scaler fitted on the training features of a trainer. Scalers are saved per trainer,
+    method and configuration of the features, and a saved scaler is only used if its method and
+    configuration match, so a stale scaler or one of other features is never reused.
+
+    Args:
+        method: The method of Scaler.
+        path: The directory of saved scalers.
+        name: The name of the trainer, such as its module.
+        config: The configuration of the features, such as the extractors and the training
+            bearings, with a stable repr as the args of FeatureCache.key().
+        fea: The training features. If given, the scaler is fitted on them and saved.
+        fit: A function fitting the scaler by calling training_scaler with the training features,
+            called if fea is None and no matching scaler is saved.
+    Return:
+        Scaler
+    '''
+    config = FeatureCache.key(config)
+    file_name = os.path.join(path,'scaler_%s_%s_%s.pkl' % (name,method,config[:16]))
+    if fea is not None:
+        scaler = Scaler(method,config).fit(fea)
+        scaler.save(file_name)
+        return scaler
+    scaler = _load_scaler(file_name,method,config)
+    if scaler is None and fit is not None:
+        fit()
+        scaler = _load_scaler(file_name,method,config)
+    if scaler is None:
+        raise ValueError('no scaler of ' + str(name) + ' is fitted by ' + str(method) + ' for these features!')
+    return scaler
+
+def _load_scaler(file_name,method,config):
+    if not os.path.exists(file_name):
+        return None
+    scaler = Scaler.load(file_name)
+    if scaler.method != method or getattr(scaler,'config',None) != config:
+        return None
+    return scaler
+
+class FeatureCache(object):
+    '''
+    A cache of features on disk. Each entry is a directory of .npy files named by the hash of its key,
+    and is opened as read-only memmaps, so a hit costs nothing until the features are used. Entries
+    are evicted by least recent use when the cache is larger than max_bytes.
+    '''
+    def __init__(self,path='./data/feature_cache/',max_bytes=4*2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*args):
+        '''
+        The hash of args, which should have a stable repr, such as strings, numbers and lists of them.
+        '''
+        return hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+
+    def get(self,key):
+        '''
+        Get the arrays of key.
+
+        Args:
+            key: The key given by FeatureCache.key().
+        Return:
+            An OrderedDict of read-only memmaps as given to put(), or None if key is not cached.
+        '''
+        dir_name = os.path.join(self.path,key)
+        try:
+            with open(os.path.join(dir_name,'meta.pkl'),'rb') as f:
+                names = pickle.load(f)
+            r_arrays = OrderedDict()
+            for i,name in enumerate(names):
+                r_arrays[name] = np.load(os.path.join(dir_name,'%d.npy' % i),mmap_mode='r')
+        except (IOError,OSError,ValueError,EOFError,pickle.UnpicklingError):
+            return None
+        os.utime(os.path.join(dir_name,'meta.pkl'))
+        return r_arrays
+
+    def put(self,key,arrays):
+        '''
+        Save arrays as the entry of key, then evict old entries if the cache is too large.
+
+        Args:
+            key: The key given by FeatureCache.key().
+            arrays: An OrderedDict like {name:numpy.ndarray}.
+        Return:
+            The arrays opened as read-only memmaps, as get() returns.
+        '''
+        dir_name = os.path.join(self.path,key)
+        temp_dir_name = dir_name + '.tmp%d' % os.getpid()
+        os.makedirs(temp_dir_name,exist_ok=True)
+        for i,x in enumerate(arrays.values()):
+            np.save(os.path.join(temp_dir_name,'%d.npy' % i),np.ascontiguousarray(x))
+        # meta.pkl is written at last, an entry without it is never read
+        with open(os.path.join(temp_dir_name,'meta.pkl'),'wb') as f:
+            pickle.dump(list(arrays.keys()),f,pickle.HIGHEST_PROTOCOL)
+        try:
+            os.replace(temp_dir_name,dir_name)
+        except OSError:
+            # cached by another process meanwhile
+            shutil.rmtree(temp_dir_name,ignore_errors=True)
+        self._evict(keep=key)
+        r_arrays = self.get(key)
+        return r_arrays if r_arrays is not None else arrays
+
+    def clear(self):
+        shutil.rmtree(self.path,ignore_errors=True)
+
+    def _evict(self,keep=None):
+        entries = []
+        for key in os.listdir(self.path):
+            meta_name = os.path.join(self.path,key,'meta.pkl')
+            if key == keep or not os.path.exists(meta_name):
+                continue
+            size = sum(os.path.getsize(os.path.join(self.path,key,x))
+                       for x in os.listdir(os.path.join(self.path,key)))
+            entries.append((os.path.getmtime(meta_name),size,key))
+        total = sum(x[1] for x in entries)
+        if keep is not None and os.path.isdir(os.path.join(self.path,keep)):
+            total += sum(os.path.getsize(os.path.join(self.path,keep,x))
+                         for x in os.listdir(os.path.join(self.path,keep)))
+        for _,size,key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.path,key),ignore_errors=True)
+            total -= size
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Feature extraction of vibration signals on torch tensors, the same features as feature.py computed
+in float32 and batched over any leading axes, such as (bearings, snapshots, channels, samples).
+"""
+
+import os
+import math
+import numpy as np
+import torch
+from feature import TIME_FEATURES, _harmonic_bands
+
+def time_features(x,features=None):
+    '''
+    Time domain features of signals, see feature.time_features.
+
+    Args:
+        x: torch.Tensor with shape (..., channels, samples).
+        features: A list of features in TIME_FEATURES, defaulted as all of them.
+    Return:
+        torch.Tensor with shape (..., channels*len(features)), features of the first channel come first.
+    '''
+    if features is None:
+        features = TIME_FEATURES
+    for name in features:
+        if name not in TIME_FEATURES:
+            raise ValueError('feature ' + str(name) + ' should be one of ' + str(TIME_FEATURES))
+    mean = x.mean(dim=-1)
+    d = x - mean.unsqueeze(-1)
+    d2 = d*d
+    var = d2.mean(dim=-1)
+    a = x.abs()
+    abs_max = a.amax(dim=-1)
+    abs_mean = a.mean(dim=-1)
+    smr = a.sqrt_().mean(dim=-1)**2
+    rms = torch.sqrt(var + mean**2)
+    p2p = x.amax(dim=-1) - x.amin(dim=-1)
+    fea = {
+        'mean':lambda: mean,
+        'rms':lambda: rms,
+        'kur':lambda: (d2*d2).mean(dim=-1) / var**2,
+        'skew':lambda: (d2*d).mean(dim=-1) / var**1.5,
+        'p2p':lambda: p2p,
+        'var':lambda: var,
+        'cre':lambda: abs_max / rms,
+        'imp':lambda: abs_max / abs_mean,
+        'mar':lambda: abs_max / smr,
+        'sha':lambda: rms / abs_mean,
+        'smr':lambda: smr,
+        'cle':lambda: p2p / smr
+    }
+    r_fea = torch.stack([fea[name]() for name in features],dim=-1)
+    return r_fea.flatten(-2)
+
+def band_energy(x,n_bands=5,edges=None,fs=25600):
+    '''
+    Energies of frequency bands of signals, see feature.band_energy.
+
+    Args:
+        x: torch.Tensor with shape (..., channels, samples).
+        n_bands: The number of equal bands, used if edges is None.
+        edges: Increasing band edges in Hz, the i-th band is [edges[i],edges[i+1]).
+        fs: The sampling rate in Hz.
+    Return:
+        torch.Tensor with shape (..., channels*bands), bands of the first channel come first.
+    '''
+    n = x.shape[-1]
+    if edges is None:
+        edges = np.linspace(0,fs/2,n_bands+1)
+    bins = np.round(np.asarray(edges,dtype=np.float64)*n/fs).astype(int)
+    if len(bins) < 2 or np.any(np.diff(bins) <= 0) or bins[0] < 0 or bins[-1] > n//2 + 1:
+        raise ValueError('edges should be increasing in [0,fs/2] and wider than a bin!')
+    spectrum = torch.fft.rfft(x,dim=-1)[...,bins[0]:bins[-1]]
+    power = (spectrum.real**2 + spectrum.imag**2) / (n*n)
+    band = torch.from_numpy(np.repeat(np.arange(len(bins)-1),np.diff(bins))).to(x.device)
+    r_fea = torch.zeros(power.shape[:-1] + (len(bins)-1,),dtype=power.dtype,device=x.device)
+    r_fea.index_add_(-1,band,power)
+    return r_fea.flatten(-2)
+
+def envelope_energy(x,frequencies,harmonics=3,bandwidth=5.,fs=25600):
+    '''
+    Energies of the envelope spectrum around characteristic frequencies, see feature.envelope_energy.
+    '''
+    n = x.shape[-1]
+    bands = torch.from_numpy(_harmonic_bands(frequencies,harmonics,bandwidth,fs,n)).to(x.device,x.dtype)
+    h = torch.full((n//2+1,),2.,dtype=x.dtype,device=x.device)
+    h[0] = 1
+    if n % 2 == 0:
+        h[-1] = 1
+    envelope = torch.fft.ifft(torch.fft.rfft(x,dim=-1)*h,n=n,dim=-1).abs()
+    envelope = envelope - envelope.mean(dim=-1,keepdim=True)
+    spectrum = torch.fft.rfft(envelope,dim=-1)
+    power = (spectrum.real**2 + spectrum.imag**2) / (n*n)
+    return (power @ bands).flatten(-2)
+
+def wavelet_packet_energy(x,level=3):
+    '''
+    Energies of the nodes of a Haar wavelet packet decomposition, see feature.wavelet_packet_energy.
+    '''
+    n = x.shape[-1]
+    if level < 1 or n % 2**level != 0:
+        raise ValueError('length of signals should be divisible by 2**level!')
+    order = torch.tensor([i ^ (i >> 1) for i in range(2**level)],device=x.device)
+    nodes = x.unsqueeze(-2)
+    for _ in range(level):
+        pairs = nodes.unflatten(-1,(-1,2))
+        nodes = torch.stack((pairs[...,0] + pairs[...,1],pairs[...,0] - pairs[...,1]),dim=-2)
+        nodes = nodes.flatten(-3,-2) / math.sqrt(2)
+    return ((nodes*nodes).sum(dim=-1)[...,order] / n).flatten(-2)
+
+FEATURE_EXTRACTORS = {'time':time_features,'fre':band_energy,'env':envelope_energy,'wpt':wavelet_packet_energy}
+
+def extract_features(data,extractors,n_threads=None,device=None,chunk_size=1024):
+    '''
+    Extract features of several arrays (such as bearings) with torch in float32, under
+    torch.inference_mode. Snapshots are moved to the device in chunks, so a long bearing does not
+    need its float32 copy of signals at once.
+
+    Args:
+        data: A list of numpy.ndarray or torch.Tensor with shape (snapshots, channels, samples),
+            or a tensor with shape (bearings, snapshots, channels, samples).
+        extractors: A list of (name, kwargs), where name is a key of FEATURE_EXTRACTORS.
+        n_threads: The number of intra-op threads of torch, defaulted as the number of CPUs.
+        device: The device computing features, defaulted as cuda if available.
+        chunk_size: The number of snapshots per chunk.
+    Return:
+        A list per array of lists per extractor of torch.Tensor with shape (snapshots, features),
+        on the device.
+    '''
+    for name,_ in extractors:
+        if name not in FEATURE_EXTRACTORS:
+            raise ValueError('extractor ' + str(name) + ' should be one of ' + str(list(FEATURE_EXTRACTORS.keys())))
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    n_threads_before = torch.get_num_threads()
+    torch.set_num_threads(n_threads or os.cpu_count())
+    r_fea = []
+    try:
+        with torch.inference_mode():
+            for x in data:
+                fea = [[] for _ in extractors]
+                for start in range(0,len(x),chunk_size):
+                    chunk = x[start:start+chunk_size]
+                    if not isinstance(chunk,torch.Tensor):
+                        chunk = torch.from_numpy(np.ascontiguousarray(chunk))
+                    chunk = chunk.to(device=device,dtype=torch.float32)
+                    for j,(name,kwargs) in enumerate(extractors):
+                        fea[j].append(FEATURE_EXTRACTORS[name](chunk,**kwargs))
+                # torch.fft fails on empty tensors, the features of a bearing without snapshots are
+                # shaped by a dummy snapshot
+                r_fea.append([torch.cat(y,dim=0) if len(y) > 0 else
+                              FEATURE_EXTRACTORS[name](torch.zeros((1,)+tuple(x.shape[1:]),device=device),**kwargs)[:0]
+                              for y,(name,kwargs) in zip(fea,extractors)])
+    finally:
+        torch.set_num_threads(n_threads_before)
+    return r_fea
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Features, batching and evaluation of bearing sequences, shared by the Seq2Seq RUL models of
+attention2.py and best_attention.py.
+"""
+
+import random
+import numpy as np
+from collections import OrderedDict
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.nn.utils import clip_grad_norm_
+import feature_torch
+from feature import extract_features, _range_normalize
+
+def feature_extractors(fea_type,time_features=None,band_edges=None,fs=25600,fault_frequencies=None,
+                       envelope_harmonics=3,envelope_bandwidth=5.,wpt_level=3):
+    '''
+    The extractors of extract_features() for a type of features.
+
+    Args:
+        fea_type: 'time', 'fre', 'all' (time and fre), 'env' or 'wpt'.
+        The others are the arguments of the extractors, fault_frequencies is needed by 'env'.
+    Return:
+        A list of (name, kwargs).
+    '''
+    time_extractor = ('time',{'features':time_features})
+    fre_extractor = ('fre',{'edges':band_edges,'fs':fs})
+    env_extractor = ('env',{'frequencies':fault_frequencies,'harmonics':envelope_harmonics,
+                            'bandwidth':envelope_bandwidth,'fs':fs})
+    wpt_extractor = ('wpt',{'level':wpt_level})
+    if fea_type == 'time':
+        return [time_extractor]
+    elif fea_type == 'fre':
+        return [fre_extractor]
+    elif fea_type == 'all':
+        return [time_extractor, fre_extractor]
+    elif fea_type == 'env':
+        return [env_extractor]
+    elif fea_type == 'wpt':
+        return [wpt_extractor]
+    raise ValueError('error selection for features!')
+
+def bearing_features(dataset,bearings,extractors,strides,cnn_k_s,feature_cache,feature_backend='numpy',
+                     n_workers=None,causal=False):
+    '''
+    Features and labels of bearings, cached without normalization. The snapshots of a bearing are
+    reversed in time unless causal, and label t is at the convolution t of the encoder.
+
+    Args:
+        dataset: The DataSet with attributes 'bearing_name', 'RUL' and 'data'.
+        bearings: A list of bearing names.
+        extractors: A list of (name, kwargs) as extract_features().
+        strides, cnn_k_s: The strides and kernel size of the convolution of the encoder.
+        feature_cache: The FeatureCache of the features.
+        feature_backend: 'numpy' or 'torch', extracting features in float32 by torch.
+        n_workers: The number of processes (numpy) or threads (torch) extracting features.
+        causal: If True, the bearings are in time order, as the causal models.
+    Return:
+        features: A list per bearing of lists per extractor of numpy.ndarray [T*1*N].
+        labels: A list per bearing of numpy.ndarray [T'*1*1].
+    '''
+    key = feature_cache.key(dataset.fingerprint(),bearings,strides,cnn_k_s,extractors,feature_backend,causal)
+    cached = feature_cache.get(key)
+    if cached is None:
+        temp_data = dataset.get_value('data',condition={'bearing_name':bearings})
+        temp_label = dataset.get_value('RUL',condition={'bearing_name':bearings})
+        cached = OrderedDict()
+        for i,x in enumerate(temp_label):
+            temp_label[i] = np.arange(temp_data[i].shape[0]) + x
+            temp_label[i] = temp_label[i][:,np.newaxis,np.newaxis]
+            temp_label[i] = temp_label[i] / np.max(temp_label[i])
+            if causal:
+                # label t of the chronological bearing is at the last snapshot of the convolution t
+                cached['label_%d' % i] = temp_label[i][::-1][cnn_k_s-1::strides]
+            else:
+                cached['label_%d' % i] = temp_label[i][:-cnn_k_s:strides] # when chang 10
+        if causal:
+            temp_data = [x.transpose(0,2,1) for x in temp_data]
+        else:
+            temp_data = [x[::-1,].transpose(0,2,1) for x in temp_data]
+        if feature_backend == 'torch':
+            features = [[y.cpu().numpy() for y in fea] for fea in
+                        feature_torch.extract_features(temp_data,extractors,n_workers)]
+        else:
+            features = extract_features(temp_data,extractors,n_workers)
+        for i,fea in enumerate(features):
+            for j,x in enumerate(fea):
+                cached['fea_%d_%d' % (i,j)] = x[:,np.newaxis,:]
+        cached = feature_cache.put(key,cached)
+
+    n = len([x for x in cached.keys() if x.startswith('label_')])
+    features = [[cached['fea_%d_%d' % (i,j)] for j in range(len(extractors))] for i in range(n)]
+    labels = [cached['label_%d' % i] for i in range(n)]
+    return features, labels
+
+def bearing_counts(dataset,bearings):
+    '''
+    The names and snapshot counts of bearings, the configuration of a scaler fitted on them, which
+    does not change when snapshots are appended to other bearings.
+    '''
+    return [dataset.get_value(x,condition={'bearing_name':bearings}) for x in ['bearing_name','quantity']]
+
+def scale_features(features,scaler=None):
+    '''
+    Concatenate the features of the extractors of every bearing and scale them.
+
+    Args:
+        features: A list per bearing of lists per extractor of numpy.ndarray [T*1*N].
+        scaler: A fitted Scaler, or None to scale the features of every extractor into [0,1] per
+            snapshot.
+    Return:
+        A list per bearing of numpy.ndarray [T*1*N].
+    '''
+    if scaler is None:
+        return [np.concatenate([_range_normalize(x,x.min(axis=2,keepdims=True),x.max(axis=2,keepdims=True),
+                                                 'min-max') for x in fea],axis=2) for fea in features]
+    return [scaler.transform(np.concatenate(fea,axis=2)) for fea in features]
+
+def tensor_iter(data,label,device):
+    # the bearings are converted once, instead of in every epoch
+    return [[torch.tensor(data[i],dtype=torch.float32,device=device),
+             torch.tensor(label[i],dtype=torch.float32,device=device)] for i in range(len(data))]
+
+def crop_batches(train_iter,strides,batch_size=1,bucket=False):
+    '''
+    Random crops of the bearings, grouped into batches of batch_size. With bucket, the batches
+    have bearings of similar lengths, so less padding.
+    '''
+    crops = []
+    for [data, label] in train_iter:
+        random_idx = random.randint(0,round(label.shape[0]*0.3))
+        crops.append([data[random_idx*strides:,], label[random_idx:,]])
+    if bucket:
+        crops.sort(key=lambda x:x[1].shape[0])
+    batches = [crops[i:i+batch_size] for i in range(0,len(crops),batch_size)]
+    if bucket:
+        random.shuffle(batches)
+    return batches
+
+def pad_batch(batch):
+    '''
+    Pad the sequences of a batch at the end with zeros.
+
+    Return:
+        data [T*B*N], label [T'*B*1], lengths of data and label as LongTensor on cpu,
+        the lengths are None for a batch of one sequence, which needs no padding.
+    '''
+    if len(batch) == 1:
+        return batch[0][0], batch[0][1], None, None
+    len_seq = torch.tensor([data.shape[0] for [data, _] in batch])
+    len_label = torch.tensor([label.shape[0] for [_, label] in batch])
+    data = nn.utils.rnn.pad_sequence([data[:,0] for [data, _] in batch])
+    label = nn.utils.rnn.pad_sequence([label[:,0] for [_, label] in batch])
+    return data, label, len_seq, len_label
+
+def masked_mse_loss(output,label,len_label=None):
+    # mean squared error over the steps inside the lengths of labels
+    if len_label is None:
+        return F.mse_loss(output,label)
+    mask = (torch.arange(label.size(0)).unsqueeze(1) < len_label.unsqueeze(0)).to(output.device)
+    mask = mask.unsqueeze(2).type_as(output)
+    return ((output - label)**2 * mask).sum() / mask.sum()
+
+def fit_epoch(model,optimizer,train_iter,strides,batch_size=1,bucket=False,grad_clip=10.0):
+    '''
+    Train the model for one epoch on random crops of the bearings.
+
+    Return:
+        The mean loss of the batches.
+    '''
+    model.train()
+    total_loss = 0
+    random.shuffle(train_iter)
+    batches = crop_batches(train_iter,strides,batch_size,bucket)
+    for batch in batches:
+        data, label, len_seq, len_label = pad_batch(batch)
+        optimizer.zero_grad()
+        output = model(data, label, len_seq=len_seq)
+        loss = masked_mse_loss(output, label, len_label)
+        loss.backward()
+        clip_grad_norm_(model.parameters(), grad_clip)
+        optimizer.step()
+        total_loss += loss.data
+    return total_loss / len(batches)
+
+def eval_batches(model,pairs,batch_size=None):
+    '''
+    Run the model on sequences sorted by length and padded into batches of batch_size, all in one
+    if None.
+
+    Return:
+        A generator of (indices of pairs, output, label, len_label) per batch.
+    '''
+    order = sorted(range(len(pairs)), key=lambda i:pairs[i][1].shape[0])
+    size = batch_size or max(len(pairs),1)
+    for i in range(0, len(order), size):
+        index = order[i:i+size]
+        data, label, len_seq, len_label = pad_batch([pairs[j] for j in index])
+        output = model(data, label, teacher_forcing_ratio=0.0, len_seq=len_seq)
+        if len_label is None:
+            len_label = torch.tensor([label.size(0)])
+        yield index, output, label, len_label
+
+def line_ratio(y,mask,strides):
+    '''
+    intercept/slope of the least squares lines of sequences inside masks, the same as
+    x[1]/x[0] of np.polyfit(t*strides,y,1) on every sequence.
+
+    Args:
+        y, mask: numpy.ndarray [B*T].
+    '''
+    y = y.astype(np.float64)
+    x = np.arange(y.shape[1]) * strides
+    n = mask.sum(axis=1)
+    mean_x = (x * mask).sum(axis=1) / n
+    mean_y = (y * mask).sum(axis=1) / n
+    dx = (x - mean_x[:,np.newaxis]) * mask
+    slope = (dx * (y - mean_y[:,np.newaxis])).sum(axis=1) / (dx * dx).sum(axis=1)
+    return (mean_y - slope * mean_x) / slope
+
+def evaluate(model,val_iter,strides,cal_er=False,batch_size=None,trim=(5,0),causal=False):
+    '''
+    The mean of mse of bearings, which run in padded batches, and the relative errors of the RUL
+    given by the zero crossings of lines fitted on the labels and the outputs.
+
+    Args:
+        strides: The strides of the convolution of the encoder, a step per strides snapshots.
+        batch_size: The bearings per forward pass, all of them if None.
+        trim: The steps (latest, earliest) of the outputs left out of the fitted lines.
+        causal: If True, the sequences are in time order, otherwise reversed.
+    Return:
+        The mean loss, and the relative errors numpy.ndarray [B] if cal_er.
+    '''
+    model.eval()
+    loss = np.zeros(len(val_iter))
+    er = np.zeros((len(val_iter),2))
+    with torch.no_grad():
+        for index, output, label, len_label in eval_batches(model, val_iter, batch_size):
+            mask = (torch.arange(label.size(0)).unsqueeze(1) < len_label.unsqueeze(0)).to(output.device)  # [T*B]
+            error = ((output - label)**2)[:,:,0] * mask
+            loss[index] = (error.sum(dim=0) / mask.sum(dim=0)).cpu().numpy()
+            if cal_er:
+                mask = mask.t().cpu().numpy()
+                len_label = len_label.numpy()
+                t = np.arange(label.size(0))
+                if causal:
+                    # chronological sequences, the first step is the earliest snapshot. The RUL at
+                    # the last step is from it to the zero crossing.
+                    x_last = (len_label - 1) * strides
+                    keep = (t >= trim[1]) & (t < len_label[:,np.newaxis] - trim[0])
+                    er[index,0] = -line_ratio(label[:,:,0].t().cpu().numpy(), mask, strides) - x_last
+                    er[index,1] = -line_ratio(output[:,:,0].t().cpu().numpy(), mask & keep, strides) - x_last
+                else:
+                    keep = (t >= trim[0]) & (t < len_label[:,np.newaxis] - trim[1])
+                    er[index,0] = line_ratio(label[:,:,0].t().cpu().numpy(), mask, strides)
+                    er[index,1] = line_ratio(output[:,:,0].t().cpu().numpy(), mask & keep, strides)
+    if cal_er:
+        er = (er[:,0] - er[:,1]) / er[:,0]
+        return np.mean(loss), er
+    else:
+        return np.mean(loss)
+
+def window_index(t,len_encoder,window,timestep,causal=False):
+    '''
+    The encoder states attended by step t with a window of attention. Step t is aligned with the
+    encoder state t, as label t with the convolution at t*strides, and the window of every sequence
+    is shifted inside its own length.
+
+    Args:
+        len_encoder: The lengths of the encoder outputs, LongTensor [B].
+        window: w attends the 2w+1 states around the step, or the w+1 states ending at it if causal.
+        timestep: The length of the padded encoder outputs.
+    Return:
+        index: LongTensor [B*W] of the attended states.
+        valid: BoolTensor [B*W] masking out the states after the step, None if not causal.
+    '''
+    valid = None
+    if causal:
+        width = min(window + 1, timestep)
+        end = torch.clamp(len_encoder - 1, max=t)
+        start = torch.clamp(end - window, min=0)  # [B]
+    else:
+        width = min(2*window + 1, timestep)
+        start = torch.clamp(torch.clamp(len_encoder - width, max=t - window), min=0)  # [B]
+    index = start.unsqueeze(1) + torch.arange(width, device=len_encoder.device).unsqueeze(0)
+    if causal:
+        # states after the step in a window starting at 0
+        valid = index <= end.unsqueeze(1)
+    return index, valid
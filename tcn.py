@@ -114,19 +114,20 @@ class GRU(nn.Module):
         return x,feature,restore
 
 class TCN_MODEL():
-    def __init__(self):
+    def __init__(self,cache=False):
         self.feature_size = 32
-        self.dataset = DataSet.load_dataset(name='phm_data')
+        self.dataset = DataSet.load_dataset(name='phm_data',cache=cache)
         self.train_bearings = ['Bearing1_1','Bearing1_2','Bearing2_1','Bearing2_2','Bearing3_1','Bearing3_2']
         self.test_bearings = ['Bearing1_3','Bearing1_4','Bearing1_5','Bearing1_6','Bearing1_7',
                                 'Bearing2_3','Bearing2_4','Bearing2_5','Bearing2_6','Bearing2_7',
                                 'Bearing3_3']
 
     def _normalize(self,data):
-        r_data = np.zeros_like(data)
-        for i in range(r_data.shape[0]):
-            r_data[i,] = ((data[i]-np.min(data[i]))/(np.max(data[i])-np.min(data[i]))-0.5)*2
-        return r_data
+        axis = tuple(range(1,data.ndim))
+        d_min = np.min(data,axis=axis,keepdims=True)
+        d_max = np.max(data,axis=axis,keepdims=True)
+        r_data = ((data-d_min)/(d_max-d_min)-0.5)*2
+        return r_data.astype(data.dtype,copy=False)
     
     def _preprocess(self,select,is_random):
         if select == 'train':
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of StreamingFeatureExtractor and Scaler on features without range, such as the first snapshot
+of a running normalization or a constant feature.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feature import Scaler, StreamingFeatureExtractor
+
+
+def test_running_first_update():
+    rng = np.random.RandomState(0)
+    extractor = StreamingFeatureExtractor([('time',{})],normalize='running')
+    fea = extractor.update(rng.randn(2560,2))
+    assert fea.shape[:2] == (1,1)
+    assert np.all(fea == 0)
+    fea = extractor.update(rng.randn(3,2560,2))
+    assert np.all(np.isfinite(fea))
+    assert fea.min() >= 0 and fea.max() <= 1
+
+
+def test_running_decade_first_update():
+    extractor = StreamingFeatureExtractor([('time',{})],normalize='running',range_type='decade')
+    fea = extractor.update(np.random.RandomState(0).randn(2560,2))
+    assert np.all(fea == 0)
+
+
+def test_scaler_constant_feature():
+    fea = np.stack([np.arange(5.),np.full(5,3.)],axis=1)
+    for method in ['min-max','decade']:
+        r_fea = Scaler(method).fit(fea).transform(fea)
+        assert np.all(np.isfinite(r_fea))
+        assert np.all(r_fea[:,1] == 0)
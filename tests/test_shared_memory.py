@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of DataSet.to_shared_memory() with the resource tracker of multiprocessing. Every case runs in
+a fresh interpreter, so the messages of its resource tracker can be checked.
+"""
+
+import os
+import sys
+import subprocess
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SPAWN_SCRIPT = textwrap.dedent('''
+    import numpy as np
+    import multiprocessing as mp
+    from dataset import DataSet
+
+    def work(handle):
+        dataset = handle.attach()
+        r_sum = float(sum(x.sum() for x in dataset.get_value('data')))
+        handle.close()
+        return r_sum
+
+    if __name__ == '__main__':
+        dataset = DataSet(name='shm_test',index=['name','data'])
+        dataset.append(['a',np.ones((10,4))])
+        dataset.append(['b',np.arange(6.).reshape(2,3)])
+        handle = dataset.to_shared_memory()
+        with mp.get_context('spawn').Pool(2) as pool:
+            print(pool.map(work,[handle]*4))
+        handle.unlink()
+        print('unlinked')
+''')
+
+def _run(script,tmp_path):
+    # spawned workers import the functions of the script, so it is run from a file
+    file_name = str(tmp_path / 'script.py')
+    with open(file_name,'w') as f:
+        f.write(script)
+    env = dict(os.environ,PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH',''))
+    return subprocess.run([sys.executable,file_name],cwd=str(tmp_path),env=env,capture_output=True,
+                          text=True,timeout=120)
+
+def test_spawn_attach_unlink(tmp_path):
+    result = _run(SPAWN_SCRIPT,tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split('\n')[:2] == ['[55.0, 55.0, 55.0, 55.0]','unlinked']
+    # the tracker complains with a KeyError at unlink() if a worker unregistered the block from the
+    # tracker it shares with the creator, and warns about leaked blocks if it was not unlinked
+    assert 'KeyError' not in result.stderr, result.stderr
+    assert 'leaked' not in result.stderr, result.stderr